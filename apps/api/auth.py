@@ -32,15 +32,14 @@ class AccessTokenAuthentication(authentication.BaseAuthentication):
         return self.authenticate_credentials(token, request)
 
     def authenticate_credentials(self, key, request):
-        try:
-            token = self.model.objects.get(key=key)
-        except self.model.DoesNotExist:
+        token = self.model.get_by_key(key)
+        if token is None:
             raise exceptions.AuthenticationFailed('Invalid token')
 
         if token.is_expired():
             raise exceptions.AuthenticationFailed('Token expired')
 
-        if not token.has_permission(request.path, request.method):
+        if not token.request_has_permission(request):
             raise exceptions.AuthenticationFailed('Token does not have permission to perform this action')
 
         token.update_last_used()  # Update last used timestamp
@@ -69,6 +68,6 @@ class AccessTokenOrIsAuthenticated(BasePermission):
 
         # For token auth, check token permissions
         if hasattr(request, 'auth') and isinstance(request.auth, AccessToken):
-            return request.auth.has_permission(request.path, request.method)
+            return request.auth.request_has_permission(request)  # Already evaluated during authentication
 
         return False
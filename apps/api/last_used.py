@@ -0,0 +1,78 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.db import close_old_connections
+
+FLUSH_INTERVAL = 30  # Seconds between two bulk writes of the buffered last_used timestamps
+
+
+class LastUsedBuffer:
+    """
+    Write-behind buffer of access token last_used timestamps.
+    Uses are recorded in memory and a background thread writes the latest one of each token with a single bulk update
+    every FLUSH_INTERVAL, so that a busy token costs one write per interval instead of one per request.
+    Whatever is still buffered is written at exit. A process that is killed or leaves through os._exit skips that, and
+    loses up to FLUSH_INTERVAL worth of uses, which only leaves last_used that much behind.
+    Forked children start with an empty buffer and their own thread, the parent's thread does not survive the fork.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # keyid -> last used datetime
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def record(self, keyid, used_at) -> None:
+        with self.lock:
+            if (previous := self.pending.get(keyid)) is None or previous < used_at:
+                self.pending[keyid] = used_at
+
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='last-used-flusher', daemon=True)
+                self.thread.start()
+
+    def after_fork(self) -> None:
+        # The lock may have been held by a thread that does not exist in the child, and the parent writes its own uses
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return None
+
+        from .models import AccessToken
+
+        tokens = [AccessToken(keyid=keyid, last_used=used_at) for keyid, used_at in pending.items()]
+        AccessToken.objects.bulk_update(tokens, ['last_used'])  # Rows of deleted tokens are simply not matched
+
+    def run(self) -> None:
+        while not self.stop_event.wait(FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing token last_used: {e}")
+            finally:
+                close_old_connections()
+
+    def shutdown(self) -> None:
+        self.stop_event.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Error writing token last_used at exit: {e}")
+
+
+last_used_buffer = LastUsedBuffer()
+
+atexit.register(last_used_buffer.shutdown)
+os.register_at_fork(after_in_child=last_used_buffer.after_fork)
@@ -0,0 +1,85 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand
+from django.urls import URLPattern
+
+from ...models import AccessToken
+from ...urls import urlpatterns, websocket_urlpatterns
+from ...utils import extract_app_name
+from ....users.models import User
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'WS:R', 'WS:W')
+
+TOKENS = {
+    'global': {'scopes': ['global'], 'attributes': {}},
+    'single scope': {'scopes': ['container-apps'], 'attributes': {}},
+    'sub-scoped': {'scopes': ['container-registry', 'secret-store'], 'attributes': {'container-registry': ['all']}},
+    'restricted': {'scopes': ['global'], 'attributes': {'container-registry': ['registry-login']}},
+}
+
+
+def sample_path(pattern: URLPattern, prefix: str) -> str:
+    route = str(pattern.pattern).lstrip('^').rstrip('$')
+    return prefix + re.sub(r'\(\?P<\w+>[^)]*\)', 'x', route)
+
+
+def has_permission_uncompiled(token: AccessToken, url_path: str, method: str) -> bool:
+    """
+    has_permission as it was before scopes were compiled, for comparison
+    """
+    if token.user.role == 'blocked' or token.is_expired():
+        return False
+
+    is_write_method = method in ('PUT', 'PATCH', 'DELETE', 'WS:W')
+    if (token.user.role == 'guest') and is_write_method:
+        return False
+
+    allowed = False
+    parts = url_path.strip('/').split('/')
+    app = parts[1] if len(parts) >= 2 else None
+
+    if ('global' in token.scopes) or (app in token.scopes):
+        allowed = True
+
+    if sub_scopes := token.attributes.get(app):
+        allowed = 'all' in sub_scopes
+
+    return (allowed and token.can_write) if is_write_method else allowed
+
+
+class Command(BaseCommand):
+    help = "Measure token permission checks across every route in apps/api/urls.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=1000, help="Passes over all routes and methods per token")
+
+    def handle(self, *args, **options):
+        rounds = options['rounds']
+        paths = [sample_path(p, '/api') for p in urlpatterns] + [sample_path(p, '/') for p in websocket_urlpatterns]
+        checks = [(path, method) for path in paths for method in METHODS]
+
+        self.stdout.write(f"{len(paths)} routes, {len(checks)} checks per round, {rounds} rounds")
+
+        for name, spec in TOKENS.items():
+            token = AccessToken(user=User(role='user'), can_write=True, **spec)
+
+            mismatches = [(p, m) for p, m in checks
+                          if token.has_permission(p, m) != has_permission_uncompiled(token, p, m)]
+            if mismatches:
+                self.stderr.write(f"{name}: compiled check disagrees on {mismatches[:5]}")
+
+            for label, check in (('before', lambda p, m: has_permission_uncompiled(token, p, m)),
+                                 ('after', token.has_permission)):
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    for path, method in checks:
+                        check(path, method)
+                elapsed = time.perf_counter() - start
+
+                total = rounds * len(checks)
+                self.stdout.write(f"{name:<14} {label:<7} {total / elapsed:>12.0f} checks/s "
+                                  f"{elapsed / total * 1e9:>8.0f} ns/check")
+
+        apps = sorted({str(extract_app_name(path)) for path in paths})
+        self.stdout.write(f"Apps covered: {', '.join(apps)}")
@@ -9,26 +9,8 @@ class KeyAuthMiddleware(BaseMiddleware):
     Middleware to authenticate access key on websockets
     """
     @database_sync_to_async
-    def get_token(self, token):
-        try:
-            token = AccessToken.objects.get(key=token)
-            return token
-        except AccessToken.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def get_user(self, token: AccessToken | str):
-        if isinstance(token, str):
-            token = self.get_token(token)
-
-        if token is None:
-            return AnonymousUser()
-
-        return token.user
-
-    @database_sync_to_async
-    def authenticate(self, token):
-        return self.get_user(token)
+    def get_token(self, key: str) -> AccessToken | None:
+        return AccessToken.get_by_key(key)  # Comes with its user, consumers can read it from async code
 
     async def __call__(self, scope, receive, send):
         headers = dict(scope['headers'])
@@ -38,10 +20,9 @@ class KeyAuthMiddleware(BaseMiddleware):
             access_key = key_header[1]
 
             token = await self.get_token(access_key)
-            user = await self.get_user(token)
 
             scope["token"] = token
-            scope["user"] = user
+            scope["user"] = token.user if token else AnonymousUser()
 
         # Auth Middleware will take care of auth in session mode
 
@@ -1,13 +1,40 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
+from django.core.cache import cache
+from django.utils.functional import cached_property
 from os import urandom
 from binascii import hexlify
+from hashlib import sha256
 
 from core.model_fields import UUID7StringField
 
 from ..users.models import User
 
 from .utils import extract_app_name
+from .last_used import last_used_buffer
+
+
+TOKEN_CACHE_TTL = 60  # Seconds a token snapshot is served from cache, changes to the token or its user drop it sooner
+# What a snapshot keeps of a token, enough to check its permissions. The key itself stays out of cache
+TOKEN_SNAPSHOT_FIELDS = ('keyid', 'user_id', 'scopes', 'attributes', 'can_write', 'expiration')
+# What it keeps of the user, which is rebuilt with the other fields deferred. Never the password. Saves of the user that
+# touch these drop its snapshots
+USER_SNAPSHOT_FIELDS = ('id', 'username', 'first_name', 'last_name', 'email', 'avatar', 'role', 'is_active')
+WRITE_METHODS = frozenset(('PUT', 'PATCH', 'DELETE', 'WS:W'))
+
+
+def access_token_version_key(keyid) -> str:
+    return f'access_token_version_{keyid}'
+
+
+def access_token_cache_key(key: str) -> str:
+    return 'access_token_snapshot_' + sha256(key.encode()).hexdigest()
+
+
+def user_tokens_version_key(user_id) -> str:
+    return f'user_tokens_version_{user_id}'
 
 
 class AccessToken(models.Model):
@@ -38,18 +65,82 @@ class AccessToken(models.Model):
         return hexlify(urandom(20)).decode()
 
     def rotate_key(self):
+        old_key = self.key
         self.key = self.generate_key()
         self.save()
+        cache.delete(access_token_cache_key(old_key))
+
+    @classmethod
+    def get_by_key(cls, key: str) -> 'AccessToken | None':
+        """
+        The token of an access key, with its user. Served from a cached snapshot when there is one, so that
+        authenticating a request and checking its permissions needs no query in the steady state. Fields of the user
+        that are not in the snapshot are loaded when first accessed
+        """
+        cache_key = access_token_cache_key(key)
+        if (snapshot := cache.get(cache_key)) is not None:
+            if cache.get(user_tokens_version_key(snapshot['user_id']), 0) == snapshot['user_version']:
+                return cls.from_snapshot(snapshot)
+
+        try:
+            token = cls.objects.select_related('user').get(key=key)
+        except cls.DoesNotExist:
+            return None
+
+        cache.set(cache_key, token.snapshot(), timeout=TOKEN_CACHE_TTL)
+        return token
+
+    def snapshot(self) -> dict:
+        """
+        The fields permission checks read with their compiled scopes, the non-secret fields of the user and the version
+        of its tokens
+        """
+        return {
+            **{f: getattr(self, f) for f in TOKEN_SNAPSHOT_FIELDS},
+            'permission_matcher': self.permission_matcher,
+            'user': {f: getattr(self.user, f) for f in USER_SNAPSHOT_FIELDS},
+            'user_version': cache.get(user_tokens_version_key(self.user_id), 0),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> 'AccessToken':
+        token = cls.from_db('default', TOKEN_SNAPSHOT_FIELDS, tuple(snapshot[f] for f in TOKEN_SNAPSHOT_FIELDS))
+        user = User.from_db('default', USER_SNAPSHOT_FIELDS, tuple(snapshot['user'][f] for f in USER_SNAPSHOT_FIELDS))
+        cls.user.field.set_cached_value(token, user)
+        token.__dict__['permission_matcher'] = snapshot['permission_matcher']  # Not compiled again per request
+        return token
 
     def update_last_used(self):
         self.last_used = timezone.now()
-        self.save()
+        AccessToken.touch(self.pk, self.last_used)
+
+    @classmethod
+    def touch(cls, keyid, now=None) -> None:
+        """
+        Record a token as used. The write is deferred and coalesced with the other uses of the token
+        """
+        last_used_buffer.record(keyid, now or timezone.now())
 
     def save(self, *args, **kwargs):
         if not self.key:
             self.key = self.generate_key()
         return super().save(*args, **kwargs)
 
+    @cached_property
+    def permission_matcher(self) -> tuple[bool, frozenset, frozenset]:
+        """
+        Scopes and sub-scopes compiled once into (global, granted apps, denied apps).
+        A non-empty sub-scope list decides on its own: 'all' grants the app, anything else denies it, even for global
+        """
+        granted = set(self.scopes)
+        denied = set()
+
+        for app, sub_scopes in self.attributes.items():
+            if sub_scopes:
+                (granted if 'all' in sub_scopes else denied).add(app)
+
+        return 'global' in self.scopes, frozenset(granted - denied), frozenset(denied)
+
     def has_permission(self, url_path: str, method: str) -> bool:
         """
         Check if token has permission for the given URL and HTTP method
@@ -60,25 +151,56 @@ class AccessToken(models.Model):
         if self.is_expired():
             return False
 
-        is_write_method = method in ('PUT', 'PATCH', 'DELETE', 'WS:W')
+        is_write_method = method in WRITE_METHODS
 
         if (self.user.role == 'guest') and is_write_method:
             return False
 
-        allowed = False
-
+        is_global, granted, denied = self.permission_matcher
         app = extract_app_name(url_path)
 
-        if ('global' in self.scopes) or (app in self.scopes):
-            allowed = True
-
-        if sub_scopes := self.attributes.get(app):
-            allowed = 'all' in sub_scopes
+        allowed = (app not in denied) and (is_global or app in granted)
 
         return (allowed and self.can_write) if is_write_method else allowed
 
+    def request_has_permission(self, request) -> bool:
+        """
+        has_permission() for a request, evaluated once per request and token
+        """
+        cached = getattr(request, '_token_permission', None)
+        if cached is not None and cached[0] == self.pk:
+            return cached[1]
+
+        allowed = self.has_permission(request.path, request.method)
+        request._token_permission = (self.pk, allowed)
+        return allowed
+
     def is_expired(self) -> bool:
         return self.expiration and self.expiration <= timezone.now()
 
     def has_app_permission(self, app: str, method: str) -> bool:
         return self.has_permission(f"x/{app}", method)
+
+
+@receiver([post_save, post_delete], sender=AccessToken)
+def invalidate_access_token(sender, instance, **kwargs):
+    cache.delete(access_token_cache_key(instance.key))
+
+    key = access_token_version_key(instance.pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Saves that leave the snapshotted fields alone, like the one recording last_login, keep the snapshots
+    if update_fields is not None and not set(USER_SNAPSHOT_FIELDS).intersection(update_fields):
+        return None
+
+    key = user_tokens_version_key(instance.pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from rest_framework.exceptions import AuthenticationFailed
+
+from ..users.models import User
+from .auth import AccessTokenAuthentication
+from .models import AccessToken
+
+
+class AccessTokenSnapshotQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='token-user', email='token-user@example.com', role='user')
+        self.token = AccessToken.objects.create(user=self.user, scopes=['container-apps'], can_write=True)
+
+    def authenticate(self, method: str = 'get'):
+        request = getattr(RequestFactory(), method)('/api/container-apps/ns-test')
+        return AccessTokenAuthentication().authenticate_credentials(self.token.key, request)
+
+    def test_cached_token_needs_no_query(self):
+        self.authenticate()  # Loads the token and caches its snapshot
+
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+            self.assertEqual(user.username, 'token-user')
+            self.assertEqual(user.email, 'token-user@example.com')
+            self.assertTrue(token.has_permission('/api/container-apps/ns-test', 'PATCH'))
+            self.assertFalse(token.has_permission('/api/secret-store/ns-test', 'GET'))
+
+        self.assertNotIn('password', user.__dict__)
+
+    def test_cached_token_keeps_compiled_scopes(self):
+        self.token.attributes = {'container-registry': ['registry-login']}
+        self.token.scopes = ['global']
+        self.token.save()
+        self.authenticate()
+
+        token = AccessToken.get_by_key(self.token.key)
+        matcher = (True, frozenset({'global'}), frozenset({'container-registry'}))
+        self.assertEqual(token.__dict__['permission_matcher'], matcher)  # Came with the snapshot
+        self.assertFalse(token.has_permission('/api/container-registry/ns-test', 'GET'))
+
+    def test_role_change_drops_snapshot(self):
+        self.authenticate()
+
+        self.user.role = 'blocked'
+        self.user.save(update_fields=['role'])
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_last_login_keeps_snapshot(self):
+        self.authenticate()
+
+        self.user.save(update_fields=['last_login'])
+
+        with self.assertNumQueries(0):
+            self.authenticate()
@@ -7,7 +7,7 @@ from . import routes
 
 from ..users import api as user_api
 from ..users.consumers import UserSearchConsumer
-from ..container_apps.consumers import AppConsumer, TerminalConsumer, LogsConsumer
+from ..container_apps.consumers import AppConsumer, TerminalConsumer, LogsConsumer, AppLogsConsumer
 
 from ..infra import api as k8s_api
 
@@ -68,6 +68,7 @@ container_apps_urlpatterns = [
     re_path(r'^/container-apps/name-check$', container_apps_api.name_check),
     re_path(r'^/container-apps/(?P<nsid>[^/]+)$', container_apps_api.container_apps),
     re_path(r'^/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)$', container_apps_api.container_apps),
+    re_path(r'^/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)/logs$', container_apps_api.app_logs),
     re_path(r'^/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)/(?P<action>[^/]+)$', container_apps_api.container_apps),
 ]
 
@@ -89,5 +90,6 @@ websocket_urlpatterns = (
             TerminalConsumer.as_asgi()),
     re_path(r'^api/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)/logs/(?P<iref>[^/]+)/(?P<cref>[^/]+)$',
             LogsConsumer.as_asgi()),
+    re_path(r'^api/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)/logs$', AppLogsConsumer.as_asgi()),
     re_path(r'^api/container-apps/(?P<nsid>[^/]+)/(?P<appid>[^/]+)$', AppConsumer.as_asgi()),
 )
@@ -62,7 +62,7 @@ def extract_app_name(url_path):
     Extract app name from URL path following the pattern:
     <origin>/<app>/<nsid>/<resource-id>/<option>
     """
-    parts = url_path.strip('/').split('/')  # Remove leading/trailing slashes
+    parts = url_path.strip('/').split('/', 2)  # Remove leading/trailing slashes, nothing past the app is needed
 
     if len(parts) >= 2:
         return parts[1]
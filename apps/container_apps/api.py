@@ -7,6 +7,7 @@ from django.http import JsonResponse
 from django.db import transaction
 from django.core.cache import cache
 from rest_framework.decorators import api_view
+from kubernetes.client.exceptions import ApiException
 
 from ..infra.models import Namespace, Volume
 from ..secret_store.models import Secret
@@ -19,6 +20,7 @@ from .utils import validate_app_spec, validate_app_update_spec, generate_meta_fo
 from ..users.utils import get_default_ns
 
 from .tasks import apply_deployment, delete_deployment, restart
+from .logs import search_logs, LogSearchError
 
 
 @api_view(['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
@@ -64,8 +66,10 @@ def container_apps(request, nsid=None, appid=None, action=None):
 
             if appid and cached_data and not brief_only:
                 result = [cached_data]
+            elif brief_only:
+                result = [ca.brief() for ca in apps]
             else:
-                result = [ca.brief() for ca in apps] if brief_only else [ca.info() for ca in apps]
+                result = [ca.info() for ca in apps.with_info()]
 
             if appid:
                 if not result:
@@ -359,6 +363,8 @@ def container_apps(request, nsid=None, appid=None, action=None):
 
                     app.ip_rule.save()
 
+                # The apply task rebuilds the record of applied objects, a stale copy would hide ones to delete
+                app.metadata.pop('spec_hashes', None)
                 app.save()
 
                 request.user.usage.cpu += usage['cpu']
@@ -424,3 +430,49 @@ def name_check(request):
     except Exception as e:
         logging.exception(e)
         return JsonResponse(error_message('Internal server error'), status=500)
+
+
+@api_view(['GET'])
+def app_logs(request, nsid, appid):
+    """
+    Search the logs of a container app instance
+    """
+    iref = request.GET.get('iref')
+    cref = request.GET.get('cref', 'main')
+
+    if not iref:
+        return JsonResponse(error_message('iref is required'), status=400)
+
+    if cref not in ('main', 'sidecar', 'init'):
+        return JsonResponse(error_message('cref must be one of main, sidecar or init'), status=400)
+
+    if not iref.startswith(f'app-{appid}'):
+        return JsonResponse(error_message('Permission denied: Cannot access this instance'), status=403)
+
+    try:
+        ns = Namespace.objects.get(nsid=nsid)
+
+        if ns.get_role(request.user) is None:
+            return JsonResponse(error_message('Namespace not found or no permission to access'), status=404)
+
+        if not ContainerApp.objects.filter(appid=appid, namespace=ns).exists():
+            return JsonResponse(error_message('Container app not found'), status=404)
+
+        result = search_logs(nsid, iref, cref, request.GET)
+        return JsonResponse(success_message('Search logs', result), status=200)
+
+    except Namespace.DoesNotExist:
+        return JsonResponse(error_message('Namespace not found or no permission to access'), status=404)
+
+    except LogSearchError as e:
+        return JsonResponse(error_message(str(e)), status=400)
+
+    except ApiException as e:
+        if e.status in (400, 404):
+            return JsonResponse(error_message('Instance or container not found'), status=404)
+        logging.exception(e)
+        return JsonResponse(error_message('Failed to get logs'), status=500)
+
+    except Exception as e:
+        logging.exception(e)
+        return JsonResponse(error_message('Internal server error'), status=500)
@@ -1,27 +1,31 @@
 import logging
 import asyncio
-import httpx
+import codecs
+import heapq
+import time
 
-from kubernetes_asyncio import client as k8s_aio_client, watch as k8s_aio_watch
+from kubernetes_asyncio import client as k8s_aio_client
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from json import dumps as json_dumps, loads as json_loads
 from base64 import b64encode, b64decode
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
 from aiohttp.http import WSMsgType
 
-from aiohttp.client_exceptions import WSServerHandshakeError, ServerDisconnectedError
+from aiohttp.client_exceptions import WSServerHandshakeError, ServerDisconnectedError, ClientPayloadError, \
+    ClientConnectionError
 from autobahn.exception import Disconnected
 
 from .models import ContainerApp
 
 from .resource import AppResource, AppResourceError
+from .informer import AppInformer, AppInformerError
 
-from core.settings import env
-from ..infra.constants import K8S_WATCH_EVENT_EQS
-
-from core.utils import error_message, get_k8s_api_client, make_hashable
-from .utils import process_pod_info, get_stat_from_deployment, process_events, fetch_usage, fetch_metric_server_stat
+from core.utils import error_message
+from core.k8s import k8s_client_pool
+from .metrics import usage_collector
 
 
 class BaseAppConsumer(AsyncWebsocketConsumer):
@@ -52,8 +56,7 @@ class BaseAppConsumer(AsyncWebsocketConsumer):
         if token:
             if not token.has_app_permission('container-apps', 'WS:R'):
                 raise AppResourceError("Token does not have permission to access this resource")
-            update_token = database_sync_to_async(lambda: token.update_last_used())
-            await update_token()
+            token.update_last_used()  # Buffered, no query
 
         if (not nsid) or (not appid):
             raise AppResourceError("nsid and appid are required")
@@ -79,7 +82,7 @@ class BaseAppConsumer(AsyncWebsocketConsumer):
 
     async def init_k8s_client(self, ws=False) -> None:
         try:
-            self.k8s_client = await get_k8s_api_client(ws=ws)
+            self.k8s_client = await k8s_client_pool.get(ws=ws)
             self.core_v1 = k8s_aio_client.CoreV1Api(self.k8s_client)
         except Exception as e:
             logging.error(f"Error initializing k8s client: {e}")
@@ -94,24 +97,6 @@ class BaseAppConsumer(AsyncWebsocketConsumer):
                 return True
         return False
 
-    async def container_exists(self, pod_name: str, container_name: str) -> bool:
-        try:
-            pod = await self.core_v1.read_namespaced_pod(name=pod_name, namespace=self.nsid)
-            container_names = [container.name for container in pod.spec.containers]
-
-            if container_name in container_names:
-                return True
-
-            if pod.spec.init_containers:
-                init_container_names = [container.name for container in pod.spec.init_containers]
-                if container_name in init_container_names:
-                    return True
-
-            return False
-
-        except Exception:
-            return False
-
     async def validate_iref_and_cref(self, iref, cref) -> None:
         if iref is None:
             raise AppResourceError("iref is required")
@@ -128,43 +113,21 @@ class BaseAppConsumer(AsyncWebsocketConsumer):
         if not self.has_container_perm(cref):
             raise AppResourceError("Permission denied: Cannot access this container")
 
-    async def get_pod_names(self, include_terminating=False) -> list[str]:
-        pods = await self.core_v1.list_namespaced_pod(namespace=self.nsid, label_selector=f'appid={self.appid}')
-
-        if include_terminating:
-            return [pod.metadata.name for pod in pods.items]
-
-        return [pod.metadata.name for pod in pods.items if pod.metadata.deletion_timestamp is None]
-
     async def disconnect(self, close_code):
-        if self.k8s_client:
-            await self.k8s_client.close()
+        # The k8s client is borrowed from the pool, give it back so it stays open for other sessions
+        await k8s_client_pool.release(self.k8s_client)
+        self.k8s_client = None
+        self.core_v1 = None
 
 
 class AppConsumer(BaseAppConsumer):
-    k8s_config = env.k8s_api_client.configuration
-    prometheus_api_url = f"{k8s_config.host}/api/v1/namespaces/prometheus/services/prometheus-server:80/proxy/api/v1"
-    metrics_api_url = f"{k8s_config.host}/apis/metrics.k8s.io/v1beta1/namespaces"
-    httpx_headers = {'Accept': 'application/json'}
-    if token := env.k8s_auth.get('token'):
-        httpx_headers['Authorization'] = f"Bearer {token}"
-        httpx_kwargs = {'headers': httpx_headers, 'verify': False}
-    else:
-        httpx_kwargs = {
-            'verify': env.k8s_auth['ca_cert'].name,
-            'cert': (env.k8s_auth['client_cert'].name, env.k8s_auth['client_key'].name),
-            'headers': httpx_headers,
-        }
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.apps_v1 = None
+        self.informer = None
         self.watch_tasks = {}
         self.pod_in_err = False
-        self.pod_dismiss_list = set()
 
-        self.pod_names = set()
         self.limits = {}
 
     async def connect(self):
@@ -174,194 +137,135 @@ class AppConsumer(BaseAppConsumer):
             await self.init_k8s_client()
             await self.init_app_resource()
 
-            self.apps_v1 = k8s_aio_client.AppsV1Api(self.k8s_client)
-
         except AppResourceError as e:
             await self.send(text_data=json_dumps(error_message(str(e))))
             await self.close()
 
+    def get_informer(self) -> AppInformer:
+        if self.informer is None:
+            self.informer = AppInformer.acquire(self.nsid, self.appid)
+        return self.informer
+
     async def watch_pods(self) -> None:
+        queue = None
         try:
-            params = {
-                'namespace': self.nsid,
-                'label_selector': f'appid={self.appid}',
-            }
+            informer = self.get_informer()
+            queue = await informer.subscribe('instances')
 
-            existing_pods = await self.core_v1.list_namespaced_pod(**params, timeout_seconds=5)
-
-            params['resource_version'] = existing_pods.metadata.resource_version
+            while True:
+                evt, pod_info = await queue.get()
 
-            sorted_pods = sorted(existing_pods.items, key=lambda x: x.metadata.creation_timestamp)
+                if evt == 'error':
+                    await self.send(text_data=json_dumps(error_message(pod_info)))
+                    await self.close()
+                    break
 
-            for pod in sorted_pods:
-                pod_info = process_pod_info(pod)
-                self.pod_names.add(pod_info['iref'])
                 await self.send(text_data=json_dumps({
                     'instance': {
-                        'event': 'add',
+                        'event': evt,
                         'data': pod_info
                     }
                 }))
-                await asyncio.sleep(0.05)
-
-            async with k8s_aio_watch.Watch().stream(self.core_v1.list_namespaced_pod, **params) as stream:
-                async for event in stream:
-                    evt, obj = event["type"], event["object"]
-                    pod_info = process_pod_info(obj)
-
-                    # Sometimes, watch returns an immature object without all info, when a pod is first created.
-                    # In that case, we skip sending it till all data becomes available in a modify event later.
-
-                    override_evt = False
-                    if (evt == 'ADDED' or evt == 'MODIFIED') and pod_info['state'] is None:
-                        self.pod_dismiss_list.add(pod_info['iref'])
-                        continue
-
-                    if pod_info['iref'] in self.pod_dismiss_list:
-                        self.pod_dismiss_list.remove(pod_info['iref'])
-                        override_evt = True
-
-                    # For keeping track of pods for usage stats
-                    if evt == 'DELETED':
-                        self.pod_names.remove(pod_info['iref'])
-                    else:
-                        self.pod_names.add(pod_info['iref'])
-
-                    await self.send(text_data=json_dumps({
-                        'instance': {
-                            'event': K8S_WATCH_EVENT_EQS[evt] if not override_evt else 'add',
-                            'data': pod_info
-                        }
-                    }))
 
         except asyncio.CancelledError:
             pass
 
+        except AppInformerError as e:
+            raise AppResourceError(str(e))
+
         except Exception:
             raise AppResourceError(f"Error watching instances")
 
+        finally:
+            if queue is not None:
+                self.informer.unsubscribe('instances', queue)
+
     async def watch_deployment(self) -> None:
+        queue = None
         try:
-            params = {
-                'namespace': self.nsid,
-                'label_selector': f'appid={self.appid}',
-            }
+            informer = self.get_informer()
+            queue = await informer.subscribe('stat')
+
+            while True:
+                evt, stat = await queue.get()
 
-            async with k8s_aio_watch.Watch().stream(self.apps_v1.list_namespaced_deployment, **params) as stream:
-                async for event in stream:
-                    evt, obj = event["type"], event["object"]
+                if evt == 'error':
+                    await self.send(text_data=json_dumps(error_message(stat)))
+                    await self.close()
+                    break
+
+                if evt == 'delete':
+                    await self.send(text_data=json_dumps(error_message("App has been deleted")))
+                    await self.close()
+                    break
 
-                    if evt == 'DELETED':
-                        await self.send(text_data=json_dumps(error_message("App has been deleted")))
-                        await self.close()
-                    else:
-                        stat = get_stat_from_deployment(obj)
-                        await self.send(text_data=json_dumps({'stat': stat}))
+                await self.send(text_data=json_dumps({'stat': stat}))
 
         except asyncio.CancelledError:
             pass
 
+        except AppInformerError as e:
+            raise AppResourceError(str(e))
+
         except Exception:
             raise AppResourceError(f"Error watching stat")
 
+        finally:
+            if queue is not None:
+                self.informer.unsubscribe('stat', queue)
+
     async def watch_events(self) -> None:
+        queue = None
         try:
-            params = {
-                'namespace': self.nsid,
-                'field_selector': f'involvedObject.name=app-{self.appid}',
-                'timeout_seconds': 5
-            }
-
-            event_hash = None
+            informer = self.get_informer()
+            queue = await informer.subscribe('events')
 
             while True:
-                events = await self.core_v1.list_namespaced_event(**params)
-                event_messages = process_events(events)
-                current_hash = hash(make_hashable(event_messages))
-
-                if event_hash != current_hash:
-                    await self.send(text_data=json_dumps({'events': event_messages}))
+                evt, data = await queue.get()
 
-                event_hash = current_hash
+                if evt == 'error':
+                    await self.send(text_data=json_dumps(error_message(data)))
+                    await self.close()
+                    break
 
-                await asyncio.sleep(10)
+                if evt == 'sync':
+                    await self.send(text_data=json_dumps({'events': data}))
+                else:
+                    await self.send(text_data=json_dumps({
+                        'event': {
+                            'event': evt,
+                            'data': data
+                        }
+                    }))
 
         except asyncio.CancelledError:
             pass
 
-        except k8s_aio_client.exceptions.ApiException as e:
-            if e.status == 404 or e.status == 400:
-                raise AppResourceError("App has been deleted")
-            else:
-                raise AppResourceError(f"Failed to get events")
+        except AppInformerError as e:
+            raise AppResourceError(str(e))
 
         except Exception:
             raise AppResourceError(f"Error watching events")
 
-    async def watch_usage(self) -> None:
-        sel = f'service=~"{self.nsid}-route-{self.appid}.*"'
+        finally:
+            if queue is not None:
+                self.informer.unsubscribe('events', queue)
 
-        p_queries = {
-            'response_bytes': f'sum(traefik_service_responses_bytes_total{{{sel}}})',
-            'request_bytes': f'sum(traefik_service_requests_bytes_total{{{sel}}})',
-            'request_count': f'sum(traefik_service_requests_total{{{sel}}})',
-        }
-
-        event_hash = None
-
-        async with httpx.AsyncClient(**self.httpx_kwargs) as client:
+    async def watch_usage(self) -> None:
+        queue = usage_collector.subscribe(self.nsid, self.appid)
+        try:
             while True:
-                try:
-                    p_tasks = [
-                        fetch_usage(client, f"{self.prometheus_api_url}/query", query, name)
-                        for name, query in p_queries.items()
-                    ]
-
-                    if self.pod_names:
-                        pods = list(self.pod_names)
-                    else:
-                        pods = await self.get_pod_names()
-
-                    m_tasks = [
-                        fetch_metric_server_stat(client, f"{self.metrics_api_url}/{self.nsid}/pods/{pod_name}")
-                        for pod_name in pods
-                    ]
-
-                    p_results = dict(zip(p_queries.keys(), await asyncio.gather(*p_tasks)))
-                    m_results = dict(zip(pods, await asyncio.gather(*m_tasks)))
-
-                    cpu_total = 0
-                    mem_total = 0
-
-                    for pod in m_results.values():
-                        cpu_total += pod['total']['cpu']
-                        mem_total += pod['total']['memory']
-
-                    cpu_total = round(cpu_total, 2)
-                    mem_total = round(mem_total, 2)
-
-                    result = {
-                        'usage': {
-                            **p_results,
-                            'cpu': cpu_total,
-                            'memory': mem_total,
-                        },
-                    }
-
-                    current_hash = hash(make_hashable(result))
-
-                    if event_hash != current_hash:
-                        await self.send(text_data=json_dumps(result))
+                usage = await queue.get()
+                await self.send(text_data=json_dumps({'usage': usage}))
 
-                    event_hash = current_hash
-
-                    await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            pass
 
-                except asyncio.CancelledError:
-                    break
+        except Exception:
+            raise AppResourceError(f"Error fetching usage")
 
-                except Exception:
-                    raise AppResourceError(f"Error fetching usage")
+        finally:
+            usage_collector.unsubscribe(self.nsid, self.appid, queue)
 
     async def receive(self, text_data=None, bytes_data=None):
         try:
@@ -399,12 +303,28 @@ class AppConsumer(BaseAppConsumer):
         for task in self.watch_tasks.values():
             task.cancel()
 
+        await asyncio.gather(*self.watch_tasks.values(), return_exceptions=True)
+
+        if self.informer:
+            await self.informer.release()
+            self.informer = None
+
         await super().disconnect(close_code)
 
 
+STDIN_CHANNEL = 0
 STDOUT_CHANNEL = 1
 STDERR_CHANNEL = 2
 ERROR_CHANNEL = 3
+RESIZE_CHANNEL = 4
+# Binary shell protocol. Frames in both directions are a channel byte followed by the raw payload, the same framing as
+# the Kubernetes exec websocket, so they are passed through as is. Clients that do not ask for it get the legacy
+# base64 text protocol.
+SHELL_PROTOCOL = 'osiris.shell.v2'
+SHELL_QUEUE_SIZE = 64  # Exec frames buffered between the container and the browser before reading pauses
+COALESCE_WINDOW = 0.005  # Seconds to wait for more output to batch into one websocket frame
+COALESCE_MAX_BYTES = 64 * 1024
+SHELL_EOF = b''  # Queued when the shell exits, real frames carry at least a channel byte and one payload byte
 EXEC_CMD = [
     '/bin/sh',
     '-c',
@@ -419,9 +339,24 @@ class TerminalConsumer(BaseAppConsumer):
         self.ws_connection = None
         self.read_task = None
         self.exec_coroutine = None
+        self.binary = False
+        self.decoders = {}
+        self.output_queue = asyncio.Queue(maxsize=SHELL_QUEUE_SIZE)
+        self.pending_output = None
+        self.shell_ready = asyncio.Event()
 
     async def connect(self):
-        await self.accept()
+        if SHELL_PROTOCOL in self.scope.get('subprotocols', []):
+            self.binary = True
+            await self.accept(subprotocol=SHELL_PROTOCOL)
+        else:
+            # Legacy clients get base64 of the text, decoded incrementally so multibyte characters split across
+            # frames are not mangled
+            self.decoders = {
+                STDOUT_CHANNEL: codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                STDERR_CHANNEL: codecs.getincrementaldecoder('utf-8')(errors='replace'),
+            }
+            await self.accept()
 
         iref = self.scope['url_route']['kwargs'].get('iref')
         cref = self.scope['url_route']['kwargs'].get('cref')
@@ -466,60 +401,31 @@ class TerminalConsumer(BaseAppConsumer):
             raise AppResourceError("Internal server error")
 
     async def read_from_shell(self):
+        """
+        Pump exec frames from the container into the output queue. Awaiting a full queue stops reading from the exec
+        websocket, which pushes back on the container when the browser does not keep up.
+        The shell is closed as soon as the sender exits, since nothing would drain the queue anymore
+        """
+        send_task = asyncio.create_task(self.send_to_client())
+
         try:
             async with await self.exec_coroutine as ws:
                 self.ws_connection = ws
-                while True:
-                    try:
-                        msg = await ws.receive(timeout=0.1)
-                    except asyncio.TimeoutError:
-                        continue
-
-                    if msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
-                        await self.send(text_data=f"msg:Closing shell")
-                        await self.close()
-                        break
-
-                    if msg.type != WSMsgType.BINARY:
-                        continue
+                self.shell_ready.set()
 
-                    if not msg.data or len(msg.data) < 2:
-                        continue
-
-                    channel = msg.data[0]
-                    data = msg.data[1:].decode("utf-8", errors="replace")
-
-                    if not data:
+                async for msg in ws:
+                    if msg.type != WSMsgType.BINARY or len(msg.data) < 2:
                         continue
+                    if not await self.queue_output(msg.data, send_task):
+                        break
+                else:
+                    await self.queue_output(SHELL_EOF, send_task)
 
-                    if channel == STDOUT_CHANNEL:
-                        try:
-                            encoded_data = b64encode(data.encode('utf-8', errors='replace')).decode('utf-8')
-                            await self.send(text_data=f"stdout:{encoded_data}")
-                        except Exception as e:
-                            logging.error(f"Error encoding stdout: {e}")
-                            await self.send(text_data=data)
-
-                    elif channel == STDERR_CHANNEL:
-                        try:
-                            encoded_error = b64encode(data.encode('utf-8', errors='replace')).decode('utf-8')
-                            await self.send(text_data=f"stderr:{encoded_error}")
-                        except Exception as e:
-                            logging.error(f"Error encoding stderr: {e}")
-                            await self.send(text_data=data)
-
-                    elif channel == ERROR_CHANNEL:
-                        try:
-                            error_data = json_loads(data)
-                            if error_data.get('status') == 'Failure':
-                                await self.send(text_data=f"msg:Container does not support shell or is not running")
-                                await self.close()
-                            else:
-                                logging.error(f"Error from exec: {error_data}")
-                        except Exception as e:
-                            logging.error(f"Error from exec: {e}")
-
-                    await asyncio.sleep(0.01)  # To prevent CPU hogging
+            await asyncio.wait({send_task})
+            if not send_task.cancelled() and (error := send_task.exception()):
+                if not isinstance(error, Disconnected):
+                    logging.error(f"Error in send_to_client: {error}")
+                    await self.close()
 
         except (asyncio.CancelledError, ServerDisconnectedError, Disconnected):
             pass
@@ -533,11 +439,135 @@ class TerminalConsumer(BaseAppConsumer):
             await self.send(text_data=f"msg:Internal server error")
             await self.close()
 
+        finally:
+            send_task.cancel()
+
+    async def queue_output(self, frame: bytes, send_task: asyncio.Task) -> bool:
+        """
+        Wait for room in the output queue, or for the sender to exit. Returns whether the frame was queued
+        """
+        if send_task.done():
+            return False
+
+        try:
+            self.output_queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        put_task = asyncio.create_task(self.output_queue.put(frame))
+        try:
+            await asyncio.wait({put_task, send_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put_task.cancel()  # No-op once the frame is in
+
+        return put_task.done() and not put_task.cancelled()
+
+    async def next_output(self, timeout: float | None = None) -> bytes:
+        if self.pending_output is not None:
+            frame, self.pending_output = self.pending_output, None
+            return frame
+
+        if timeout is None:
+            return await self.output_queue.get()
+
+        try:
+            return self.output_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return await asyncio.wait_for(self.output_queue.get(), timeout)
+
+    async def send_to_client(self) -> None:
+        """
+        Send queued output to the client, coalescing the frames of a channel that arrive within COALESCE_WINDOW into
+        one websocket message of up to COALESCE_MAX_BYTES
+        """
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                frame = await self.next_output()
+                if frame == SHELL_EOF:
+                    await self.send(text_data=f"msg:Closing shell")
+                    await self.close()
+                    break
+
+                channel = frame[0]
+
+                if channel == ERROR_CHANNEL:
+                    await self.handle_exec_error(frame[1:])
+                    continue
+
+                if channel != STDOUT_CHANNEL and channel != STDERR_CHANNEL:
+                    continue
+
+                chunks = [frame[1:]]
+                size = len(chunks[0])
+                deadline = loop.time() + COALESCE_WINDOW
+
+                while size < COALESCE_MAX_BYTES and (remaining := deadline - loop.time()) > 0:
+                    try:
+                        next_frame = await self.next_output(timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+                    if next_frame == SHELL_EOF or next_frame[0] != channel:
+                        self.pending_output = next_frame  # Handled with the next batch
+                        break
+
+                    chunks.append(next_frame[1:])
+                    size += len(next_frame) - 1
+
+                await self.send_output(channel, b''.join(chunks))
+
+        except asyncio.CancelledError:
+            pass
+
+    async def handle_exec_error(self, data: bytes) -> None:
+        try:
+            error_data = json_loads(data)
+            if error_data.get('status') == 'Failure':
+                await self.send(text_data=f"msg:Container does not support shell or is not running")
+                await self.close()
+            else:
+                logging.error(f"Error from exec: {error_data}")
+        except Exception as e:
+            logging.error(f"Error from exec: {e}")
+
+    async def send_output(self, channel: int, data: bytes) -> None:
+        """
+        Send stdout/stderr output to the client, as a raw channel frame in binary mode
+        """
+        if self.binary:
+            await self.send(bytes_data=bytes([channel]) + data)
+            return None
+
+        text = self.decoders[channel].decode(data)
+        if not text:
+            return None
+
+        encoded_data = b64encode(text.encode('utf-8')).decode('utf-8')
+        await self.send(text_data=f"{'stdout' if channel == STDOUT_CHANNEL else 'stderr'}:{encoded_data}")
+
     async def receive(self, text_data=None, bytes_data=None):
         """
         Directly pass input to the container
         """
-        if not self.ws_connection or not text_data:
+        if not self.ws_connection:
+            return None
+
+        if bytes_data:
+            if not self.binary or bytes_data[0] not in (STDIN_CHANNEL, RESIZE_CHANNEL):
+                return None
+
+            try:
+                await self.ws_connection.send_bytes(bytes_data)
+            except Exception as e:
+                logging.error(f"Error sending stdin data: {e}")
+                await self.send(text_data=f"msg:Error sending command")
+                await self.close()
+            return None
+
+        if not text_data:
             return None
 
         try:
@@ -571,24 +601,21 @@ class TerminalConsumer(BaseAppConsumer):
             return
 
         try:
-            stdin_channel_prefix = chr(0)
-            await self.ws_connection.send_bytes((stdin_channel_prefix + data).encode("utf-8"))
+            await self.ws_connection.send_bytes(bytes([STDIN_CHANNEL]) + data.encode("utf-8"))
         except Exception as e:
             logging.error(f"Error sending stdin data: {e}")
             await self.send(text_data=f"msg:Error sending command")
             await self.close()
 
     async def set_terminal_size(self, cols, rows):
-        for _ in range(10):
-            if not self.ws_connection or not self.core_v1:
-                await asyncio.sleep(0.5)
-            else:
-                break
+        try:
+            await asyncio.wait_for(self.shell_ready.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            return None
 
         try:
             resize_message = json_dumps({"Width": cols, "Height": rows})
-            control_channel_prefix = chr(4)
-            await self.ws_connection.send_bytes((control_channel_prefix + resize_message).encode("utf-8"))
+            await self.ws_connection.send_bytes(bytes([RESIZE_CHANNEL]) + resize_message.encode("utf-8"))
         except Exception:
             await self.send_stdin(f"msg:stty error. Terminal may not work as expected")
 
@@ -606,6 +633,48 @@ class TerminalConsumer(BaseAppConsumer):
         await super().disconnect(close_code)
 
 
+LOG_READ_SIZE = 64 * 1024
+LOG_FLUSH_INTERVAL = 0.1  # Seconds between two log frames
+LOG_BATCH_LINES = 500  # Lines that trigger a flush before the interval is over, and the max lines per frame
+LOG_BUFFER_LINES = 5000  # Lines kept for a client that falls behind, older ones are dropped
+LOG_SEND_QUEUE_FRAMES = 10  # Frames waiting for the sender, the flusher holds back further lines beyond this
+MERGE_DELAY = 0.5  # Seconds a line waits for lines with earlier timestamps from slower instances
+MERGE_BUFFER_LINES = 5000  # Lines held for merging, the oldest are sent early beyond this
+MERGE_MAX_LINES = 2 * MERGE_BUFFER_LINES  # Lines held at most, newer ones are dropped and reported beyond this
+FOLLOW_RETRY_DELAY = 1  # Seconds before a failed log stream of an instance is opened again, doubled on every failure
+FOLLOW_RETRY_MAX_DELAY = 30  # Seconds between retries at most
+
+
+async def read_log_lines(response):
+    """
+    Yields the complete lines of each chunk read from a streamed pod log response
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    partial = ''
+
+    async for chunk in response.content.iter_chunked(LOG_READ_SIZE):
+        lines = (partial + decoder.decode(chunk)).split('\n')
+        partial = lines.pop()  # Incomplete until the next newline
+        yield [line.rstrip('\r') for line in lines]
+
+    if partial := (partial + decoder.decode(b'', final=True)).strip():
+        yield [partial]
+
+
+def has_logs(container_info: dict) -> bool:
+    # Init containers never report started, a running or finished container has logs either way
+    return bool(container_info.get('started')) or container_info.get('state') in ('running', 'terminated',
+                                                                                  'terminating')
+
+
+def split_log_timestamp(line: str) -> tuple[datetime | None, str]:
+    ts, _, message = line.partition(' ')
+    try:
+        return datetime.fromisoformat(ts), message
+    except ValueError:
+        return None, line
+
+
 class LogsConsumer(BaseAppConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -616,6 +685,15 @@ class LogsConsumer(BaseAppConsumer):
         self.closing = False
         self.log_task = None
         self.check_task = None
+        self.flush_task = None
+        self.send_task = None
+        self.informer = None
+        self.log_buffer = deque(maxlen=LOG_BUFFER_LINES)
+        self.dropped_lines = 0
+        self.lines_ready = asyncio.Event()
+        self.batch_ready = asyncio.Event()
+        self.stream_ended = False
+        self.send_queue = None
 
     async def connect(self):
         await self.accept()
@@ -628,8 +706,8 @@ class LogsConsumer(BaseAppConsumer):
             await self.validate_iref_and_cref(self.iref, self.cref)
             await self.init_k8s_client()
 
-            self.log_task = asyncio.create_task(self.stream_logs())
-            self.check_task = asyncio.create_task(self.container_check())
+            self.informer = AppInformer.acquire(self.nsid, self.appid)
+            self.start_streaming()
 
         except AppResourceError as e:
             await self.send(text_data=json_dumps(error_message(str(e))))
@@ -640,12 +718,128 @@ class LogsConsumer(BaseAppConsumer):
             await self.send(text_data=json_dumps(error_message("Internal server error")))
             await self.disconnect(1)
 
-    async def container_check(self):
+    def start_streaming(self) -> None:
+        self.closing = False
+        self.stream_ended = False
+        self.send_queue = asyncio.Queue(maxsize=LOG_SEND_QUEUE_FRAMES)
+        self.log_task = asyncio.create_task(self.stream_logs())
+        self.flush_task = asyncio.create_task(self.flush_logs())
+        self.send_task = asyncio.create_task(self.send_frames())
+        self.check_task = asyncio.create_task(self.watch_instance())
+
+    def instance_gone(self, evt: str, pod_info: dict | None = None) -> bool:
+        # Terminating pods are left to finish, so that their shutdown logs still come through
+        if pod_info is not None and pod_info['iref'] == self.iref:
+            return evt == 'delete'
+
+        # Missing from the store once it has synced, the pod is gone already
+        return self.informer.pods_synced and self.iref not in self.informer.pods
+
+    def container_missing(self, pod_info: dict) -> bool:
+        # Statuses come in for all containers of a pod at once. Until then, as while the pod is pending, none is missing
+        reported = any(pod_info[c_type].get('state') is not None for c_type in ('main', 'sidecar', 'init'))
+        return reported and not (pod_info.get(self.cref) or {}).get('state')
+
+    async def watch_instance(self):
+        """
+        Follow the instance through the app informer. Close the session if the instance has no such container, and the
+        stream as soon as the instance is deleted
+        """
+        queue = None
         try:
+            queue = await self.informer.subscribe('instances')
+
             while not self.closing:
-                if not await self.container_exists(self.iref, self.cref):
+                evt, pod_info = await queue.get()
+
+                if evt == 'error':
+                    continue  # The log stream itself ends when the container goes away
+
+                if evt != 'delete' and pod_info['iref'] == self.iref and self.container_missing(pod_info):
+                    await self.send(text_data=json_dumps(error_message("Container does not exist")))
+                    await self.close()
+                    break
+
+                if self.instance_gone(evt, pod_info):
                     self.closing = True
-                await asyncio.sleep(5)
+                    if self.stream:
+                        self.stream.close()  # Ends the read in stream_logs
+
+        except asyncio.CancelledError:
+            pass
+
+        except AppInformerError as e:
+            logging.error(f"Error watching instance {self.iref}: {e}")
+
+        finally:
+            if queue is not None:
+                self.informer.unsubscribe('instances', queue)
+
+    def buffer_lines(self, lines: list[str]) -> None:
+        """
+        Queue lines for the next batch. The server gives no drain signal for the socket, so a send only waits for the
+        frame to be handed over and the buffer size is all that bounds memory. Lines are dropped only when the buffer
+        overflows, which keeps the newest ones and counts the ones it dropped
+        """
+        overflow = len(self.log_buffer) + len(lines) - LOG_BUFFER_LINES
+        if overflow > 0:
+            self.dropped_lines += overflow
+
+        self.log_buffer.extend(lines)
+        self.lines_ready.set()
+
+        if len(self.log_buffer) >= LOG_BATCH_LINES:
+            self.batch_ready.set()
+
+    async def flush_logs(self):
+        """
+        Queue buffered lines as one {'logs': [...]} frame per LOG_FLUSH_INTERVAL, or as soon as LOG_BATCH_LINES are in.
+        Once the stream has ended, queues whatever is left and returns
+        """
+        try:
+            while True:
+                await self.lines_ready.wait()
+
+                if not self.stream_ended:
+                    try:
+                        await asyncio.wait_for(self.batch_ready.wait(), timeout=LOG_FLUSH_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+
+                if message := self.take_batch():
+                    await self.send_queue.put(message)  # Waits while the client is behind
+
+                if self.stream_ended and not self.log_buffer and not self.dropped_lines:
+                    return None
+
+        except asyncio.CancelledError:
+            pass
+
+    def take_batch(self) -> dict | None:
+        batch_size = min(len(self.log_buffer), LOG_BATCH_LINES)
+        lines = [self.log_buffer.popleft() for _ in range(batch_size)]
+
+        if not self.log_buffer:
+            self.lines_ready.clear()
+        if len(self.log_buffer) < LOG_BATCH_LINES:
+            self.batch_ready.clear()
+
+        message = {'logs': lines}
+        if self.dropped_lines:
+            message['dropped'] = self.dropped_lines
+            self.dropped_lines = 0
+
+        return message if lines or 'dropped' in message else None
+
+    async def send_frames(self):
+        try:
+            while True:
+                message = await self.send_queue.get()
+                try:
+                    await self.send(text_data=json_dumps(message))
+                finally:
+                    self.send_queue.task_done()
+
         except asyncio.CancelledError:
             pass
 
@@ -662,24 +856,22 @@ class LogsConsumer(BaseAppConsumer):
                 _preload_content=False
             )
 
-            while not self.closing:
-                try:
-                    line = await asyncio.wait_for(self.stream.content.readline(), timeout=5.0)
-                    if not line:
-                        continue
-
-                    line_str = line.decode('utf-8').strip()
-                    await self.send(text_data=json_dumps({'log': line_str}))
+            try:
+                async for lines in read_log_lines(self.stream):
+                    self.buffer_lines(lines)
 
-                except asyncio.TimeoutError:
-                    continue
+            except (ClientPayloadError, ClientConnectionError):
+                if not self.closing:
+                    raise
 
-                finally:
-                    await asyncio.sleep(0.01)
+            # Let the flusher queue what is left and wait for it to go out before telling the client the stream is over
+            self.stream_ended = True
+            self.lines_ready.set()
+            await self.flush_task
+            await self.send_queue.join()
 
-            else:
-                await self.send(text_data=json_dumps(error_message("Container has been terminated")))
-                await self.close()
+            await self.send(text_data=json_dumps(error_message("Container has been terminated")))
+            await self.close()
 
         except asyncio.CancelledError:
             pass
@@ -713,12 +905,10 @@ class LogsConsumer(BaseAppConsumer):
             self.tail_lines = tail_lines
 
             await self.stop_streaming()
-            await asyncio.sleep(0.01)
-
-            self.closing = False
 
-            self.log_task = asyncio.create_task(self.stream_logs())
-            self.check_task = asyncio.create_task(self.container_check())
+            self.log_buffer.clear()
+            self.dropped_lines = 0
+            self.start_streaming()
 
         except Exception as e:
             logging.error(f"Error in log receive", e)
@@ -743,13 +933,261 @@ class LogsConsumer(BaseAppConsumer):
             finally:
                 self.stream = None
 
-        if self.log_task and not self.log_task.done():
-            self.log_task.cancel()
-            try:
-                await self.log_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self.log_task, self.flush_task, self.send_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
 
     async def disconnect(self, close_code):
         await self.stop_streaming()
+
+        if self.informer:
+            await self.informer.release()
+            self.informer = None
+
+        await super().disconnect(close_code)
+
+
+class AppLogsConsumer(BaseAppConsumer):
+    """
+    Follows a container of every instance of an app and merges their logs into one stream ordered by timestamp, with
+    each line tagged with its instance. Instances come and go with the app informer's pod watch
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cref = 'main'
+        self.tail_lines = 100
+        self.informer = None
+        self.watch_task = None
+        self.flush_task = None
+        self.streams = {}  # iref -> follow task
+        # iref -> (timestamp of the last line, lines seen at that timestamp), to skip lines replayed on restart
+        self.last_seen = {}
+        self.ended = {}  # iref -> restart count of a terminated container whose log was read to the end
+        self.merge_heap = []
+        self.dropped_lines = 0
+        self.seq = 0
+        self.lines_ready = asyncio.Event()
+
+    async def connect(self):
+        await self.accept()
+
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.cref = params.get('cref', ['main'])[0]
+
+        try:
+            if self.cref not in ('main', 'sidecar', 'init'):
+                raise AppResourceError("Permission denied: Cannot access this container")
+
+            if tail_lines := params.get('tail_lines', [None])[0]:
+                if not tail_lines.isdigit():
+                    raise AppResourceError("tail_lines must be a positive integer")
+                self.tail_lines = int(tail_lines)
+
+            await self.authenticate_and_init()
+            await self.init_k8s_client()
+
+            self.informer = AppInformer.acquire(self.nsid, self.appid)
+            self.watch_task = asyncio.create_task(self.watch_instances())
+            self.flush_task = asyncio.create_task(self.flush_logs())
+
+        except AppResourceError as e:
+            await self.send(text_data=json_dumps(error_message(str(e))))
+            await self.close()
+
+        except Exception as e:
+            logging.error(f"Error in connect: {e}")
+            await self.send(text_data=json_dumps(error_message("Internal server error")))
+            await self.close()
+
+    async def watch_instances(self):
+        queue = None
+        try:
+            queue = await self.informer.subscribe('instances')
+
+            while True:
+                evt, pod_info = await queue.get()
+
+                if evt == 'error':
+                    await self.send(text_data=json_dumps(error_message(pod_info)))
+                    await self.close()
+                    break
+
+                iref = pod_info['iref']
+
+                if evt == 'delete':
+                    if task := self.streams.pop(iref, None):
+                        task.cancel()
+                    self.last_seen.pop(iref, None)
+                    self.ended.pop(iref, None)
+                    continue
+
+                # Follow once the container has started, and again after it restarts
+                container = pod_info.get(self.cref, {})
+                if not has_logs(container) or iref in self.streams:
+                    continue
+
+                if container.get('state') == 'terminated' and self.ended.get(iref) == container.get('restarts'):
+                    continue  # Already read to the end
+
+                self.streams[iref] = asyncio.create_task(self.follow(iref, container))
+
+        except asyncio.CancelledError:
+            pass
+
+        except AppInformerError as e:
+            await self.send(text_data=json_dumps(error_message(str(e))))
+            await self.close()
+
+        finally:
+            if queue is not None:
+                self.informer.unsubscribe('instances', queue)
+
+    async def follow(self, iref: str, container: dict):
+        """
+        Read the container's log of an instance to the end. A stream that fails is opened again with backoff for as long
+        as the instance exists, resuming after the last line seen
+        """
+        delay = FOLLOW_RETRY_DELAY
+        try:
+            while True:
+                progress = self.last_seen.get(iref)
+                try:
+                    await self.read_logs(iref, container)
+                    break
+
+                except (ClientPayloadError, ClientConnectionError, asyncio.TimeoutError):
+                    pass
+
+                except k8s_aio_client.exceptions.ApiException as e:
+                    if e.status in (400, 404):  # Container not started yet or already gone, the informer starts it again
+                        break
+                    logging.error(f"Error following logs of {iref}: {e}")
+
+                except Exception as e:
+                    logging.error(f"Error following logs of {iref}: {e}")
+
+                if iref not in self.informer.pods:
+                    break
+
+                if self.last_seen.get(iref) != progress:
+                    delay = FOLLOW_RETRY_DELAY  # The stream was working, this is a new failure
+
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FOLLOW_RETRY_MAX_DELAY)
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            if self.streams.get(iref) is asyncio.current_task():
+                del self.streams[iref]
+
+    async def read_logs(self, iref: str, container: dict):
+        # A restarted stream replays the tail, which was already sent up to the last line seen
+        resume_ts, resume_skip = self.last_seen.get(iref, (None, 0))
+        response = None
+        try:
+            response = await self.core_v1.read_namespaced_pod_log(
+                name=iref,
+                namespace=self.nsid,
+                container=self.cref,
+                follow=True,
+                tail_lines=self.tail_lines,
+                timestamps=True,
+                _preload_content=False
+            )
+
+            async for lines in read_log_lines(response):
+                for line in lines:
+                    ts, _ = split_log_timestamp(line)
+                    ts = ts or datetime.now(timezone.utc)
+
+                    if resume_ts and ts < resume_ts:
+                        continue
+
+                    # Lines can share a timestamp, only as many as were seen at the last one are replays
+                    if resume_ts and ts == resume_ts and resume_skip > 0:
+                        resume_skip -= 1
+                        continue
+
+                    self.merge_line(iref, ts, line)
+
+            if container.get('state') == 'terminated':
+                self.ended[iref] = container.get('restarts')
+
+        finally:
+            if response is not None:
+                response.close()
+
+    def merge_line(self, iref: str, ts: datetime, line: str) -> None:
+        last_ts, count = self.last_seen.get(iref, (None, 0))
+        self.last_seen[iref] = (ts, count + 1 if ts == last_ts else 1)
+
+        if len(self.merge_heap) >= MERGE_MAX_LINES:
+            self.dropped_lines += 1
+            return None
+
+        self.seq += 1
+        heapq.heappush(self.merge_heap, (ts, self.seq, time.monotonic(), iref, line))
+        self.lines_ready.set()
+
+    def take_batch(self) -> list[dict]:
+        ready_before = time.monotonic() - MERGE_DELAY
+        batch = []
+
+        while self.merge_heap and len(batch) < LOG_BATCH_LINES:
+            _, _, arrived, iref, line = self.merge_heap[0]
+            if arrived > ready_before and len(self.merge_heap) <= MERGE_BUFFER_LINES:
+                break
+
+            heapq.heappop(self.merge_heap)
+            batch.append({'iref': iref, 'log': line})
+
+        if not self.merge_heap:
+            self.lines_ready.clear()
+
+        return batch
+
+    async def flush_logs(self):
+        """
+        Send merged lines once they have waited MERGE_DELAY for slower instances, in order of their timestamps.
+        Full batches go out back to back, the flusher only waits LOG_FLUSH_INTERVAL after a partial one
+        """
+        try:
+            while True:
+                await self.lines_ready.wait()
+
+                batch = self.take_batch()
+
+                message = {'logs': batch}
+                if self.dropped_lines:
+                    message['dropped'] = self.dropped_lines
+                    self.dropped_lines = 0
+
+                if batch or 'dropped' in message:
+                    await self.send(text_data=json_dumps(message))
+
+                if len(batch) < LOG_BATCH_LINES:
+                    await asyncio.sleep(LOG_FLUSH_INTERVAL)
+
+        except asyncio.CancelledError:
+            pass
+
+    async def disconnect(self, close_code):
+        tasks = [t for t in (self.watch_task, self.flush_task, *self.streams.values()) if t]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.streams = {}
+
+        if self.informer:
+            await self.informer.release()
+            self.informer = None
+
         await super().disconnect(close_code)
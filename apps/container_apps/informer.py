@@ -0,0 +1,370 @@
+import asyncio
+import logging
+
+from collections import OrderedDict
+from json import loads as json_loads
+from kubernetes_asyncio import client as k8s_aio_client, watch as k8s_aio_watch
+
+from core.k8s import k8s_client_pool
+from ..infra.constants import K8S_WATCH_EVENT_EQS
+
+from .utils import process_pod_info, get_stat_from_deployment, process_event, process_events
+
+WATCH_TIMEOUT = 300  # Seconds before the API server closes a watch and we resume from the last resourceVersion
+RETRY_DELAY = 2
+EVENT_BUFFER_SIZE = 50  # Most recent events kept per app
+
+
+class AppInformerError(Exception):
+    pass
+
+
+class AppInformer:
+    """
+    Process wide list+watch of the pods, deployment and events of a container app.
+    All websocket sessions of an app share one informer, which keeps an in-memory store of the app's pods,
+    deployment stat and a bounded buffer of recent events, and fans out processed deltas to every subscriber.
+    Informers are reference counted with acquire()/release() and torn down when the last session leaves.
+    """
+    informers = {}
+
+    def __init__(self, nsid: str, appid: str):
+        self.nsid = nsid
+        self.appid = appid
+        self.label_selector = f'appid={appid}'
+        self.ref_count = 0
+
+        self.pods = {}  # iref -> (creation_timestamp, pod_info)
+        self.pods_synced = False
+        self.pod_dismiss_list = set()
+        self.stat = None
+        self.events = OrderedDict()  # uid -> event, oldest first
+        self.events_synced = False
+
+        self.subscribers = {
+            'instances': set(),
+            'stat': set(),
+            'events': set(),
+        }
+        self.tasks = {}
+
+    @classmethod
+    def acquire(cls, nsid: str, appid: str) -> 'AppInformer':
+        """
+        Returns the shared informer for the app, creating it if needed. Every acquire() must be paired with a release()
+        """
+        key = (nsid, appid)
+        informer = cls.informers.get(key)
+        if informer is None:
+            informer = cls.informers[key] = cls(nsid, appid)
+
+        informer.ref_count += 1
+        return informer
+
+    async def release(self) -> None:
+        self.ref_count -= 1
+        if self.ref_count > 0:
+            return None
+
+        if self.informers.get((self.nsid, self.appid)) is self:
+            del self.informers[(self.nsid, self.appid)]
+
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks = {}
+
+    @staticmethod
+    async def check_k8s_client() -> None:
+        """
+        Fail the subscription early when the pool has no client to watch with. Watchers borrow their own on every reconnect
+        """
+        try:
+            async with k8s_client_pool.borrow():
+                pass
+        except Exception as e:
+            logging.error(f"Error initializing k8s client: {e}")
+            raise AppInformerError("Failed to connect to cluster. Contact support")
+
+    async def subscribe(self, kind: str) -> asyncio.Queue:
+        """
+        Subscribe to 'instances', 'stat' or 'events' deltas. Returns a queue of (event, data) tuples, primed with the
+        current state of the store so that late subscribers see the same view as the ones that were there from the start.
+        Events subscribers first receive a ('sync', [events]) snapshot, then incremental add/modify/delete deltas.
+        """
+        await self.check_k8s_client()
+
+        queue = asyncio.Queue()
+
+        if kind == 'instances' and self.pods_synced:
+            for _, pod_info in sorted(self.pods.values(), key=lambda x: x[0]):
+                queue.put_nowait(('add', pod_info))
+
+        elif kind == 'stat' and self.stat is not None:
+            queue.put_nowait(('modify', self.stat))
+
+        elif kind == 'events' and self.events_synced:
+            queue.put_nowait(('sync', self.event_snapshot()))
+
+        self.subscribers[kind].add(queue)
+
+        if kind not in self.tasks:
+            watchers = {
+                'instances': self.watch_pods,
+                'stat': self.watch_deployment,
+                'events': self.watch_events,
+            }
+            self.tasks[kind] = asyncio.create_task(watchers[kind]())
+
+        return queue
+
+    def unsubscribe(self, kind: str, queue: asyncio.Queue) -> None:
+        self.subscribers[kind].discard(queue)
+
+    def publish(self, kind: str, event: str, data) -> None:
+        for queue in self.subscribers[kind]:
+            queue.put_nowait((event, data))
+
+    @property
+    def pod_names(self) -> list[str]:
+        return list(self.pods.keys())
+
+    def sync_pods(self, pods) -> None:
+        """
+        Replace the pod store with a fresh list and publish the difference
+        """
+        current = {}
+        for pod in sorted(pods, key=lambda x: x.metadata.creation_timestamp):
+            pod_info = process_pod_info(pod)
+            current[pod_info['iref']] = (pod.metadata.creation_timestamp, pod_info)
+
+        for iref, (_, pod_info) in self.pods.items():
+            if iref not in current:
+                self.publish('instances', 'delete', pod_info)
+
+        for iref, (_, pod_info) in current.items():
+            if iref not in self.pods:
+                self.publish('instances', 'add', pod_info)
+            elif self.pods[iref][1] != pod_info:
+                self.publish('instances', 'modify', pod_info)
+
+        self.pods = current
+        self.pods_synced = True
+
+    def handle_pod_event(self, evt: str, pod) -> None:
+        pod_info = process_pod_info(pod)
+        iref = pod_info['iref']
+
+        # Sometimes, watch returns an immature object without all info, when a pod is first created.
+        # In that case, we skip sending it till all data becomes available in a modify event later.
+
+        if (evt == 'ADDED' or evt == 'MODIFIED') and pod_info['state'] is None:
+            self.pod_dismiss_list.add(iref)
+            return None
+
+        event = K8S_WATCH_EVENT_EQS[evt]
+
+        if iref in self.pod_dismiss_list:
+            self.pod_dismiss_list.remove(iref)
+            event = 'add'
+
+        if evt == 'DELETED':
+            self.pods.pop(iref, None)
+        else:
+            if event == 'modify' and iref not in self.pods:
+                event = 'add'
+            self.pods[iref] = (pod.metadata.creation_timestamp, pod_info)
+
+        self.publish('instances', event, pod_info)
+
+    async def watch_pods(self) -> None:
+        params = {
+            'namespace': self.nsid,
+            'label_selector': self.label_selector,
+        }
+        resource_version = None
+
+        try:
+            while True:
+                try:
+                    # Borrowed per watch, so that a reconnect picks up the client the pool replaced an unhealthy one with
+                    async with k8s_client_pool.borrow() as k8s_client:
+                        core_v1 = k8s_aio_client.CoreV1Api(k8s_client)
+
+                        if resource_version is None:
+                            existing_pods = await core_v1.list_namespaced_pod(**params, timeout_seconds=5)
+                            resource_version = existing_pods.metadata.resource_version
+                            self.sync_pods(existing_pods.items)
+
+                        watcher = k8s_aio_watch.Watch()
+                        async with watcher.stream(core_v1.list_namespaced_pod,
+                                                  resource_version=resource_version,
+                                                  timeout_seconds=WATCH_TIMEOUT,
+                                                  **params) as stream:
+                            async for event in stream:
+                                self.handle_pod_event(event['type'], event['object'])
+
+                    # Watch expired, resume from where we left off
+                    resource_version = watcher.resource_version or resource_version
+
+                except k8s_aio_client.exceptions.ApiException as e:
+                    if e.status != 410:
+                        raise e
+                    resource_version = None  # History is gone, relist
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            logging.error(f"Error watching instances of app {self.appid}: {e}")
+            self.publish('instances', 'error', "Error watching instances")
+            self.tasks.pop('instances', None)
+
+    async def watch_deployment(self) -> None:
+        params = {
+            'namespace': self.nsid,
+            'label_selector': self.label_selector,
+        }
+
+        try:
+            while True:
+                try:
+                    async with k8s_client_pool.borrow() as k8s_client:
+                        apps_v1 = k8s_aio_client.AppsV1Api(k8s_client)
+
+                        async with k8s_aio_watch.Watch().stream(apps_v1.list_namespaced_deployment,
+                                                                timeout_seconds=WATCH_TIMEOUT,
+                                                                **params) as stream:
+                            async for event in stream:
+                                evt, obj = event["type"], event["object"]
+
+                                if evt == 'DELETED':
+                                    self.stat = None
+                                    self.publish('stat', 'delete', None)
+                                else:
+                                    stat = get_stat_from_deployment(obj)
+                                    if stat != self.stat:  # Re-watching replays ADDED events for unchanged objects
+                                        self.stat = stat
+                                        self.publish('stat', 'modify', stat)
+
+                except k8s_aio_client.exceptions.ApiException as e:
+                    if e.status != 410:
+                        raise e
+
+                await asyncio.sleep(RETRY_DELAY)
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            logging.error(f"Error watching deployment of app {self.appid}: {e}")
+            self.publish('stat', 'error', "Error watching stat")
+            self.tasks.pop('stat', None)
+
+    def event_snapshot(self) -> list[dict]:
+        return sorted(
+            self.events.values(),
+            key=lambda x: (x['time'] is None, x['time'] or ''),
+            reverse=True
+        )
+
+    def trim_events(self) -> None:
+        while len(self.events) > EVENT_BUFFER_SIZE:
+            _, evicted = self.events.popitem(last=False)
+            self.publish('events', 'delete', evicted)
+
+    def sync_events(self, events: list[dict]) -> None:
+        """
+        Replace the event buffer with a fresh list and publish the difference
+        """
+        current = OrderedDict((e['id'], e) for e in reversed(process_events(events)))
+
+        if self.events_synced:
+            for uid, event in self.events.items():
+                if uid not in current:
+                    self.publish('events', 'delete', event)
+
+            for uid, event in current.items():
+                if uid not in self.events:
+                    self.publish('events', 'add', event)
+                elif self.events[uid] != event:
+                    self.publish('events', 'modify', event)
+
+        self.events = current
+        self.trim_events()
+
+        if not self.events_synced:
+            self.events_synced = True
+            self.publish('events', 'sync', self.event_snapshot())
+
+    def handle_event(self, evt: str, obj: dict) -> None:
+        event = process_event(obj)
+        uid = event['id']
+
+        if evt == 'DELETED':
+            if self.events.pop(uid, None) is not None:
+                self.publish('events', 'delete', event)
+            return None
+
+        existing = self.events.get(uid)
+        if existing == event:
+            return None
+
+        self.events[uid] = event
+        self.events.move_to_end(uid)
+        self.publish('events', 'add' if existing is None else 'modify', event)
+        self.trim_events()
+
+    async def watch_events(self) -> None:
+        params = {
+            'namespace': self.nsid,
+            'field_selector': f'involvedObject.name=app-{self.appid}',
+        }
+        resource_version = None
+
+        try:
+            while True:
+                try:
+                    async with k8s_client_pool.borrow() as k8s_client:
+                        core_v1 = k8s_aio_client.CoreV1Api(k8s_client)
+
+                        if resource_version is None:
+                            resp = await core_v1.list_namespaced_event(**params, timeout_seconds=5,
+                                                                       _preload_content=False)
+                            events = json_loads(await resp.read())
+                            resource_version = events['metadata']['resourceVersion']
+                            self.sync_events(events['items'])
+
+                        # Raw objects, since BOOKMARK events only carry metadata and do not deserialize into V1Event
+                        watcher = k8s_aio_watch.Watch(return_type='object')
+                        async with watcher.stream(core_v1.list_namespaced_event,
+                                                  resource_version=resource_version,
+                                                  allow_watch_bookmarks=True,
+                                                  timeout_seconds=WATCH_TIMEOUT,
+                                                  **params) as stream:
+                            async for event in stream:
+                                # The watcher tracks the resourceVersion of bookmarks, nothing else to do for them
+                                if event['type'] != 'BOOKMARK':
+                                    self.handle_event(event['type'], event['raw_object'])
+
+                    resource_version = watcher.resource_version or resource_version
+
+                except k8s_aio_client.exceptions.ApiException as e:
+                    if e.status != 410:
+                        raise e
+                    resource_version = None  # History is gone, relist
+
+        except asyncio.CancelledError:
+            pass
+
+        except k8s_aio_client.exceptions.ApiException as e:
+            if e.status == 404 or e.status == 400:
+                self.publish('events', 'error', "App has been deleted")
+            else:
+                self.publish('events', 'error', "Failed to get events")
+            self.tasks.pop('events', None)
+
+        except Exception as e:
+            logging.error(f"Error watching events of app {self.appid}: {e}")
+            self.publish('events', 'error', "Error watching events")
+            self.tasks.pop('events', None)
@@ -0,0 +1,226 @@
+import codecs
+import re
+import regex
+import time
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timezone
+from itertools import islice
+from json import dumps as json_dumps, loads as json_loads
+
+from .resource import AppResource
+
+READ_SIZE = 64 * 1024
+MAX_SEARCH_BYTES = 32 * 1024 * 1024  # Most of a log read per page, from the start of the searched window
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+MAX_REGEX_LENGTH = 256
+REGEX_TIMEOUT = 2  # Seconds a search may spend matching its regex, over all the lines it scans
+
+LEVELS = ('debug', 'info', 'warn', 'error', 'fatal')
+LEVEL_RE = re.compile(r'\b(TRACE|DEBUG|INFO|WARN(?:ING)?|ERROR|ERR|FATAL|CRIT(?:ICAL)?|PANIC)\b', re.IGNORECASE)
+LEVEL_ALIASES = {
+    'trace': 'debug',
+    'warning': 'warn',
+    'err': 'error',
+    'crit': 'fatal',
+    'critical': 'fatal',
+    'panic': 'fatal',
+}
+
+
+class LogSearchError(Exception):
+    pass
+
+
+def parse_time(value: str) -> datetime:
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(ts: datetime, skip: int) -> str:
+    return urlsafe_b64encode(json_dumps({'ts': ts.isoformat(), 'skip': skip}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        data = json_loads(urlsafe_b64decode(cursor.encode()))
+        return parse_time(data['ts']), int(data['skip'])
+    except Exception:
+        raise LogSearchError("Invalid cursor")
+
+
+def log_level(message: str) -> str | None:
+    if match := LEVEL_RE.search(message):
+        level = match.group(1).lower()
+        return LEVEL_ALIASES.get(level, level)
+    return None
+
+
+def read_lines(response):
+    """
+    Yields the lines of a pod log response as they are read, without holding more than a chunk in memory
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    partial = ''
+
+    try:
+        for chunk in response.stream(READ_SIZE):
+            lines = (partial + decoder.decode(chunk)).split('\n')
+            partial = lines.pop()
+            yield from (line.rstrip('\r') for line in lines)
+
+        if partial := (partial + decoder.decode(b'', final=True)).strip():
+            yield partial
+
+    finally:
+        response.close()
+
+
+def parse_lines(lines):
+    """
+    Splits the timestamp the kubelet prepends to every line, lines without one keep the previous timestamp
+    """
+    ts = None
+    for line in lines:
+        raw_ts, _, message = line.partition(' ')
+        try:
+            ts = parse_time(raw_ts)
+        except ValueError:
+            message = line
+            if ts is None:
+                continue
+        yield ts, message
+
+
+def filter_time(entries, since: datetime | None = None, until: datetime | None = None):
+    for ts, message in entries:
+        if since and ts < since:
+            continue
+        if until and ts > until:
+            return None  # Logs are in order, nothing later can match
+        yield ts, message
+
+
+def filter_text(entries, query: str):
+    query = query.lower()
+    return ((ts, message) for ts, message in entries if query in message.lower())
+
+
+def filter_regex(entries, pattern: regex.Pattern):
+    """
+    Match with a time budget for the whole scan, so that a catastrophically backtracking regex cannot hold the worker
+    """
+    budget = REGEX_TIMEOUT
+    for ts, message in entries:
+        started = time.monotonic()
+        try:
+            if budget <= 0:
+                raise TimeoutError
+            matched = pattern.search(message, timeout=budget)
+        except TimeoutError:
+            raise LogSearchError("regex is too slow to match, try a simpler one or a narrower time range")
+
+        budget -= time.monotonic() - started
+        if matched:
+            yield ts, message
+
+
+def filter_level(entries, levels: set[str]):
+    return ((ts, message) for ts, message in entries if log_level(message) in levels)
+
+
+def skip_to_cursor(entries, cursor_ts: datetime, skip: int):
+    """
+    Drops the matches a previous page returned: all of them before the cursor time, and the first few at it
+    """
+    for ts, message in entries:
+        if ts < cursor_ts:
+            continue
+        if ts == cursor_ts and skip > 0:
+            skip -= 1
+            continue
+        yield ts, message
+
+
+def search_logs(nsid: str, iref: str, cref: str, params) -> dict:
+    """
+    Search the log of a container, with the filters and pagination of the query params.
+    Returns the page of matching lines, oldest first, and the cursor of the next page if there is one.
+    :param params: q, regex, level (comma separated), since, until (ISO 8601), since_seconds, limit, cursor
+    """
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+        since_seconds = int(params['since_seconds']) if params.get('since_seconds') else None
+        since = parse_time(params['since']) if params.get('since') else None
+        until = parse_time(params['until']) if params.get('until') else None
+    except ValueError:
+        raise LogSearchError("Invalid limit, since_seconds, since or until")
+
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise LogSearchError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    if since_seconds is not None and since_seconds <= 0:
+        raise LogSearchError("since_seconds must be a positive integer")
+
+    levels = None
+    if level := params.get('level'):
+        levels = {lvl.strip().lower() for lvl in level.split(',')}
+        if not levels.issubset(LEVELS):
+            raise LogSearchError(f"level must be one or more of {', '.join(LEVELS)}")
+
+    pattern = None
+    if expr := params.get('regex'):
+        if len(expr) > MAX_REGEX_LENGTH:
+            raise LogSearchError(f"regex must be at most {MAX_REGEX_LENGTH} characters")
+        try:
+            pattern = regex.compile(expr)
+        except regex.error:
+            raise LogSearchError("Invalid regex")
+
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+
+    # Only fetch the part of the log that can still match
+    starts = [ts for ts in (since, cursor[0] if cursor else None) if ts]
+    if starts:
+        elapsed = max(int((datetime.now(timezone.utc) - max(starts)).total_seconds()) + 1, 1)
+        since_seconds = min(since_seconds, elapsed) if since_seconds else elapsed
+
+    response = AppResource.core_v1.read_namespaced_pod_log(
+        name=iref,
+        namespace=nsid,
+        container=cref,
+        timestamps=True,
+        since_seconds=since_seconds,
+        limit_bytes=MAX_SEARCH_BYTES,
+        _preload_content=False
+    )
+
+    entries = filter_time(parse_lines(read_lines(response)), since, until)
+    if query := params.get('q'):
+        entries = filter_text(entries, query)
+    if pattern:
+        entries = filter_regex(entries, pattern)
+    if levels:
+        entries = filter_level(entries, levels)
+    if cursor:
+        entries = skip_to_cursor(entries, *cursor)
+
+    try:
+        page = list(islice(entries, limit + 1))  # One more, to tell whether there is a next page
+    finally:
+        response.close()  # Stops reading whatever is left of the log
+
+    next_cursor = None
+    if len(page) > limit:
+        page.pop()
+        last_ts = page[-1][0]
+        skip = sum(1 for ts, _ in page if ts == last_ts)
+        if cursor and cursor[0] == last_ts:
+            skip += cursor[1]
+        next_cursor = encode_cursor(last_ts, skip)
+
+    return {
+        'logs': [{'time': ts.isoformat(), 'log': message} for ts, message in page],
+        'cursor': next_cursor,
+    }
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+import httpx
+
+from core.settings import env
+
+from .utils import fetch_usage_by_service, fetch_pod_metrics, process_pod_metrics
+
+COLLECT_INTERVAL = 5  # Seconds between two collection rounds
+CACHE_TTL = 10  # Seconds a collected usage stays fresh enough to prime new subscribers
+
+PROMETHEUS_QUERIES = {
+    'response_bytes': 'traefik_service_responses_bytes_total',
+    'request_bytes': 'traefik_service_requests_bytes_total',
+    'request_count': 'traefik_service_requests_total',
+}
+
+
+def get_httpx_kwargs() -> dict:
+    headers = {'Accept': 'application/json'}
+
+    if token := env.k8s_auth.get('token'):
+        headers['Authorization'] = f"Bearer {token}"
+        return {'headers': headers, 'verify': False}
+
+    return {
+        'verify': env.k8s_auth['ca_cert'].name,
+        'cert': (env.k8s_auth['client_cert'].name, env.k8s_auth['client_key'].name),
+        'headers': headers,
+    }
+
+
+class UsageCollector:
+    """
+    Process wide collector of container app usage metrics.
+    Instead of every websocket session polling Prometheus and the metrics server on its own, one background task
+    collects the usage of all the apps being watched with a handful of batched requests per round, caches the
+    results and publishes them to the subscribed sessions, only when they changed.
+    The task and its HTTP client are started with the first subscriber and stopped after the last one leaves.
+    """
+
+    def __init__(self):
+        k8s_host = env.k8s_api_client.configuration.host
+        self.prometheus_api_url = f"{k8s_host}/api/v1/namespaces/prometheus/services/prometheus-server:80/proxy/api/v1"
+        self.metrics_api_url = f"{k8s_host}/apis/metrics.k8s.io/v1beta1/namespaces"
+
+        self.subscribers = {}  # (nsid, appid) -> set of queues
+        self.cache = {}  # (nsid, appid) -> (collected_at, usage)
+        self.pending = set()  # Queues that have not received a usage yet
+        self.task = None
+
+    def subscribe(self, nsid: str, appid: str) -> asyncio.Queue:
+        """
+        Returns a queue of usage dicts for the app, primed with the cached usage if it is still fresh
+        """
+        key = (nsid, appid)
+        queue = asyncio.Queue()
+
+        cached = self.cache.get(key)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL:
+            queue.put_nowait(cached[1])
+        else:
+            self.pending.add(queue)
+
+        self.subscribers.setdefault(key, set()).add(queue)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+        return queue
+
+    def unsubscribe(self, nsid: str, appid: str, queue: asyncio.Queue) -> None:
+        key = (nsid, appid)
+        queues = self.subscribers.get(key)
+        if queues is None:
+            return None
+
+        queues.discard(queue)
+        self.pending.discard(queue)
+        if not queues:
+            del self.subscribers[key]
+
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, key: tuple, usage: dict, changed=True) -> None:
+        for queue in self.subscribers.get(key, ()):
+            if changed or queue in self.pending:
+                queue.put_nowait(usage)
+                self.pending.discard(queue)
+
+    async def collect_traffic(self, client, keys: list[tuple]) -> dict[tuple, dict]:
+        """
+        Traefik counters of all the apps, with one query per counter grouped by service
+        """
+        prefixes = {f"{nsid}-route-{appid}": (nsid, appid) for nsid, appid in keys}
+        sel = f'service=~"{"|".join(f"{prefix}.*" for prefix in prefixes)}"'
+
+        results = await asyncio.gather(*[
+            fetch_usage_by_service(client, f"{self.prometheus_api_url}/query",
+                                   f'sum by (service) ({metric}{{{sel}}})', name)
+            for name, metric in PROMETHEUS_QUERIES.items()
+        ])
+
+        traffic = {key: {name: 0 for name in PROMETHEUS_QUERIES} for key in keys}
+
+        for name, by_service in zip(PROMETHEUS_QUERIES.keys(), results):
+            for service, value in by_service.items():
+                # Longest match, so that an appid which prefixes another one does not steal its services
+                matches = [prefix for prefix in prefixes if service.startswith(prefix)]
+                if matches:
+                    traffic[prefixes[max(matches, key=len)]][name] += value
+
+        return traffic
+
+    async def collect_resources(self, client, keys: list[tuple]) -> dict[tuple, dict]:
+        """
+        CPU and memory of all the apps, with one metrics server list per namespace
+        """
+        appids_by_ns = {}
+        for nsid, appid in keys:
+            appids_by_ns.setdefault(nsid, []).append(appid)
+
+        nsids = list(appids_by_ns.keys())
+        results = await asyncio.gather(*[
+            fetch_pod_metrics(client, f"{self.metrics_api_url}/{nsid}/pods", appids_by_ns[nsid])
+            for nsid in nsids
+        ])
+
+        resources = {key: {'cpu': 0, 'memory': 0} for key in keys}
+
+        for nsid, pods in zip(nsids, results):
+            for pod in pods:
+                key = (nsid, pod.get('metadata', {}).get('labels', {}).get('appid'))
+                if key in resources:
+                    total = process_pod_metrics(pod)['total']
+                    resources[key]['cpu'] += total['cpu']
+                    resources[key]['memory'] += total['memory']
+
+        return resources
+
+    async def collect(self, client) -> None:
+        keys = list(self.subscribers.keys())
+        if not keys:
+            return None
+
+        traffic, resources = await asyncio.gather(self.collect_traffic(client, keys),
+                                                  self.collect_resources(client, keys))
+        now = time.monotonic()
+
+        for key in keys:
+            usage = {
+                **traffic[key],
+                'cpu': round(resources[key]['cpu'], 2),
+                'memory': round(resources[key]['memory'], 2),
+            }
+
+            cached = self.cache.get(key)
+            self.cache[key] = (now, usage)
+
+            self.publish(key, usage, changed=cached is None or cached[1] != usage)
+
+        # Forget apps nobody is watching anymore
+        for key in [k for k in self.cache if k not in self.subscribers]:
+            del self.cache[key]
+
+    async def run(self) -> None:
+        try:
+            async with httpx.AsyncClient(**get_httpx_kwargs()) as client:
+                while self.subscribers:
+                    try:
+                        await self.collect(client)
+                    except Exception as e:
+                        logging.error(f"Error collecting usage: {e}")
+
+                    await asyncio.sleep(COLLECT_INTERVAL)
+
+        except asyncio.CancelledError:
+            pass
+
+
+usage_collector = UsageCollector()
@@ -138,6 +138,19 @@ class AppFW(models.Model):
         }
 
 
+class ContainerAppQuerySet(models.QuerySet):
+    def with_info(self):
+        """
+        Fetch everything info() touches up front, so that serializing any number of apps takes a constant number of
+        queries
+        """
+        return self.select_related('scaler', 'ingress', 'ip_rule').prefetch_related(
+            models.Prefetch('containers', queryset=Container.objects.select_related('pull_secret', 'env_secret')),
+            'volumes',
+            'ingress__hosts',
+        )
+
+
 class ContainerApp(models.Model):
     appid = UUID7StringField(auto_created=True)
     namespace = models.ForeignKey(Namespace, on_delete=models.CASCADE)
@@ -160,6 +173,8 @@ class ContainerApp(models.Model):
     state = models.CharField(max_length=16, choices=R_STATES, default='creating')
     metadata = models.JSONField(default=dict)
 
+    objects = ContainerAppQuerySet.as_manager()
+
     def volume_info(self):
         result = []
         for vol in self.volumes.all():
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+
+from hashlib import sha256
+from json import dumps as json_dumps
+from kubernetes_asyncio import client as k8s_aio_client
+
+from core.utils import get_k8s_api_client
+
+FIELD_MANAGER = 'osiris-cloud'
+# Managers of the objects created and replaced before server-side apply, the kubernetes client's user agent
+LEGACY_FIELD_MANAGERS = {'OpenAPI-Generator'}
+SPEC_HASH_ANNOTATION = 'osiriscloud.io/spec-hash'
+MAX_CONCURRENCY = 16  # Max in-flight API requests per reconciliation
+
+PLURALS = {
+    'Secret': 'secrets',
+    'PersistentVolumeClaim': 'persistentvolumeclaims',
+    'Service': 'services',
+    'Deployment': 'deployments',
+    'Middleware': 'middlewares',
+    'IngressRoute': 'ingressroutes',
+    'ScaledObject': 'scaledobjects',
+}
+
+# Objects only ever created, their spec is immutable for the most part once bound
+CREATE_ONLY_KINDS = {'PersistentVolumeClaim'}
+
+
+class ReconcilerError(Exception):
+    pass
+
+
+def object_path(api_version: str, kind: str, namespace: str, name: str | None = None) -> str:
+    if '/' in api_version:
+        path = f"/apis/{api_version}/namespaces/{namespace}/{PLURALS[kind]}"
+    else:
+        path = f"/api/{api_version}/namespaces/{namespace}/{PLURALS[kind]}"
+
+    return f"{path}/{name}" if name else path
+
+
+def object_ref(manifest: dict) -> str:
+    return f"{manifest['kind']}/{manifest['metadata']['name']}"
+
+
+def spec_hash(manifest: dict) -> str:
+    """
+    Stable content hash of a manifest, independent of key order
+    """
+    return sha256(json_dumps(manifest, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def merge_fields(into: dict, fields: dict) -> dict:
+    """
+    Union of two managedFields field sets
+    """
+    for key, value in fields.items():
+        merge_fields(into.setdefault(key, {}), value)
+    return into
+
+
+def adopt_managed_fields(managed_fields: list[dict]) -> list[dict] | None:
+    """
+    Hands the fields set by the legacy create/replace calls over to our apply manager, so that fields since dropped from
+    the manifest are removed by the next apply instead of staying owned by a manager that never comes back.
+    Returns the new managedFields, or None if the object was already applied by us or there is nothing to adopt.
+    """
+    if any(e.get('manager') == FIELD_MANAGER and e.get('operation') == 'Apply' for e in managed_fields):
+        return None
+
+    adopted = None
+    entries = []
+    for entry in managed_fields:
+        if entry.get('manager') in LEGACY_FIELD_MANAGERS and entry.get('operation') == 'Update' \
+                and not entry.get('subresource'):
+            if adopted is None:
+                adopted = {**entry, 'manager': FIELD_MANAGER, 'operation': 'Apply', 'fieldsV1': {}}
+                entries.append(adopted)
+            merge_fields(adopted['fieldsV1'], entry.get('fieldsV1') or {})
+        else:
+            entries.append(entry)
+
+    return entries if adopted else None
+
+
+class Reconciler:
+    """
+    Applies the desired state of an app to the cluster.
+    The desired state is a list of stages, each a list of manifests. Manifests within a stage are independent and are
+    applied concurrently, while a stage only starts once the previous one is done, so that secrets and volumes exist
+    before the deployment referencing them. Every object is applied with a server-side apply request, objects created
+    before server-side apply first have their managed fields handed over to our field manager.
+    Objects are stamped with a hash of their spec. Ones whose hash matches the last applied one are skipped without a
+    request, the others are compared with the hash on their live object first. A forced reconciliation applies
+    everything, which repairs objects that were deleted or replaced behind our back.
+    Manifests rendered with values that change on every render, like freshly minted tokens, carry a hash of their
+    inputs in the spec hash annotation, which is used instead of hashing the manifest.
+    """
+
+    def __init__(self, nsid: str, spec_hashes: dict | None = None, force: bool = False):
+        """
+        :param spec_hashes: Object reference -> spec hash, as last applied. None when there is no record
+        :param force: Apply every object, even the ones that are up to date
+        """
+        self.nsid = nsid
+        self.spec_hashes = spec_hashes
+        self.force = force
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        self.api_client = None
+
+    async def request(self, method: str, path: str, body=None, query_params=None, content_type=None):
+        header_params = {'Accept': 'application/json'}
+        if content_type:
+            header_params['Content-Type'] = content_type
+
+        async with self.semaphore:
+            return await self.api_client.call_api(
+                path, method,
+                query_params=query_params or [],
+                header_params=header_params,
+                body=body,
+                auth_settings=['BearerToken'],
+                response_types_map={200: 'object', 201: 'object'},
+                _return_http_data_only=True,
+            )
+
+    async def get_object(self, path: str) -> dict | None:
+        try:
+            return await self.request('GET', path)
+        except k8s_aio_client.exceptions.ApiException as e:
+            if e.status == 404:
+                return None
+            raise e
+
+    async def take_ownership(self, path: str, live: dict) -> None:
+        """
+        Move the fields of an object created before server-side apply to our field manager, on its first apply
+        """
+        managed_fields = adopt_managed_fields(live['metadata'].get('managedFields') or [])
+        if managed_fields is None:
+            return None
+
+        await self.request('PATCH', path, body=[
+            {'op': 'test', 'path': '/metadata/resourceVersion', 'value': live['metadata']['resourceVersion']},
+            {'op': 'replace', 'path': '/metadata/managedFields', 'value': managed_fields},
+        ], content_type='application/json-patch+json')
+
+    async def apply_object(self, manifest: dict) -> bool | None:
+        """
+        Server-side apply a manifest, unless the live object already carries its spec hash.
+        Returns True if it was applied, None if it was up to date, False if it failed
+        """
+        name = manifest['metadata']['name']
+
+        try:
+            if manifest['kind'] in CREATE_ONLY_KINDS:
+                try:
+                    await self.request('POST', object_path(manifest['apiVersion'], manifest['kind'], self.nsid),
+                                       body=manifest, content_type='application/json')
+                except k8s_aio_client.exceptions.ApiException as e:
+                    if e.status != 409:
+                        raise e
+                    return None
+                return True
+
+            path = object_path(manifest['apiVersion'], manifest['kind'], self.nsid, name)
+
+            if live := await self.get_object(path):
+                live_hash = (live['metadata'].get('annotations') or {}).get(SPEC_HASH_ANNOTATION)
+                if not self.force and live_hash == manifest['metadata']['annotations'][SPEC_HASH_ANNOTATION]:
+                    return None
+
+                await self.take_ownership(path, live)
+
+            # The manifest goes out as JSON, which is valid YAML for the apply patch
+            await self.request(
+                'PATCH', path,
+                body=manifest,
+                query_params=[('fieldManager', FIELD_MANAGER), ('force', 'true')],
+                content_type='application/apply-patch+yaml',
+            )
+            return True
+
+        except Exception:
+            logging.error(f"Failed to apply {object_ref(manifest)} in {self.nsid}", exc_info=True)
+            return False
+
+    async def delete_object(self, api_version: str, kind: str, name: str) -> bool:
+        try:
+            await self.request('DELETE', object_path(api_version, kind, self.nsid, name))
+            return True
+
+        except k8s_aio_client.exceptions.ApiException as e:
+            if e.status == 404:
+                return True
+            logging.error(f"Failed to delete {kind}/{name} in {self.nsid}", exc_info=True)
+            return False
+
+    async def reconcile(self, stages: list[list[dict]], deletions: list[tuple] = ()) -> dict:
+        """
+        :param stages: Manifests to apply, stage by stage
+        :param deletions: (api_version, kind, name) of objects that should no longer exist, removed after the last stage
+        Returns the references of the objects that were touched and that failed, and the spec hashes to keep for the
+        next reconciliation
+        """
+        known = self.spec_hashes or {}
+        hashes = {}
+        touched = []
+        failed = []
+
+        pending = []
+        for stage in stages:
+            changed = []
+            for manifest in stage:
+                ref = object_ref(manifest)
+                annotations = manifest['metadata'].setdefault('annotations', {})
+                hashes[ref] = annotations.get(SPEC_HASH_ANNOTATION) or spec_hash(manifest)
+                annotations[SPEC_HASH_ANNOTATION] = hashes[ref]
+
+                if self.force or known.get(ref) != hashes[ref]:
+                    changed.append(manifest)
+
+            if changed:
+                pending.append(changed)
+
+        # Objects we have a record of never applying are known to not exist
+        if not self.force and self.spec_hashes is not None:
+            deletions = [d for d in deletions if f"{d[1]}/{d[2]}" in known]
+
+        if not pending and not deletions:
+            return {'touched': touched, 'failed': failed, 'hashes': hashes}
+
+        self.api_client = await get_k8s_api_client()
+        if self.api_client is None:
+            raise ReconcilerError("Failed to connect to cluster")
+
+        try:
+            for stage in pending:
+                results = await asyncio.gather(*[self.apply_object(manifest) for manifest in stage])
+                for manifest, ok in zip(stage, results):
+                    if ok is not None:
+                        (touched if ok else failed).append(object_ref(manifest))
+
+            results = await asyncio.gather(*[self.delete_object(*deletion) for deletion in deletions])
+            for (_, kind, name), ok in zip(deletions, results):
+                (touched if ok else failed).append(f"{kind}/{name}")
+
+        finally:
+            await self.api_client.close()
+            self.api_client = None
+
+        # Failed objects are retried next time. They stay in the record, since they may exist in part
+        for ref in failed:
+            if ref in hashes:
+                hashes[ref] = ''
+
+        return {'touched': touched, 'failed': failed, 'hashes': hashes}
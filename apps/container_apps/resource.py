@@ -1,6 +1,8 @@
 import kubernetes
 import logging
 
+from asgiref.sync import async_to_sync
+
 from base64 import b64encode
 from datetime import datetime
 from json import loads as json_loads
@@ -8,6 +10,8 @@ from json import loads as json_loads
 from core.settings import env
 
 from .models import Container, ContainerApp
+from .reconciler import Reconciler, SPEC_HASH_ANNOTATION, spec_hash
+from ..container_registry.keys import get_signing_key
 from ..infra.models import Volume
 from ..secret_store.models import Secret
 
@@ -23,9 +27,9 @@ class AppResourceError(Exception):
 
 
 class AppResource:
+    # Objects are applied by the Reconciler, these clients only serve deletes, redeploys, log reads and serialization
     apps_v1 = kubernetes.client.AppsV1Api(env.k8s_api_client)
     core_v1 = kubernetes.client.CoreV1Api(env.k8s_api_client)
-    networking_v1 = kubernetes.client.NetworkingV1Api(env.k8s_api_client)
     custom_objects = kubernetes.client.CustomObjectsApi(env.k8s_api_client)
 
     def __init__(self, app: ContainerApp, request=None):
@@ -38,24 +42,59 @@ class AppResource:
         self.pull_secrets = set()
         self.request = request
 
-    def apply(self):
-        self.create_pull_secrets()
+    def apply(self, force=False) -> list[str]:
+        """
+        :param force: Apply every object, even the ones that did not change since the last apply
+        Returns the objects that were created, updated or deleted
+        """
         self.delete_pvc()
-        self.create_pvc()
-        self.create_secrets()
-        self.create_deployment()
-        self.create_service()
-        self.create_fw_rules()
-        self.create_route()
-        self.create_autoscaler()
+
+        reconciler = Reconciler(self.nsid, spec_hashes=self.app.metadata.get('spec_hashes'), force=force)
+        result = async_to_sync(reconciler.reconcile)(*self.gen_desired_state())
+
+        if result['failed']:
+            logging.error(f"Failed to apply {', '.join(result['failed'])} of app {self.app.appid}")
+
+        if result['touched']:
+            logging.info(f"Applied {', '.join(result['touched'])} of app {self.app.appid}")
+
+        # Only write the fields we own, the app may have been edited while it was being applied
+        metadata = ContainerApp.objects.filter(pk=self.app.pk).values_list('metadata', flat=True).first() or {}
+        metadata['spec_hashes'] = result['hashes']
+        self.app.metadata = metadata
         self.app.state = 'created'
-        self.app.save()
+        self.app.save(update_fields=['metadata', 'state'])
+
+        return result['touched']
+
+    def gen_desired_state(self) -> tuple[list[list[dict]], list[tuple]]:
+        """
+        Returns the manifests of the app in the order they must be applied, and the objects to remove.
+        Pull secrets, secrets and volumes come first, then the workload and its service and middlewares,
+        then the route and autoscaler that point at them
+        """
+        to_manifest = AppResource.core_v1.api_client.sanitize_for_serialization
+
+        stage_0 = [to_manifest(obj) for obj in self.gen_pull_secrets() + self.gen_secrets() + self.gen_pvcs()]
+        stage_1 = [to_manifest(self.gen_deployment()), to_manifest(self.gen_service())] + self.gen_fw_rules()
+        stage_2 = []
+        deletions = []
+
+        if route := self.gen_route():
+            stage_2.append(route)
+
+        if autoscaler := self.gen_autoscaler():
+            stage_2.append(autoscaler)
+        else:  # Delete autoscaler if no scalers are defined
+            deletions.append(("keda.sh/v1alpha1", "ScaledObject", "scaler-" + self.app.appid))
+
+        return [stage_0, stage_1, stage_2], deletions
 
     def delete(self):
         if self.delete_deployment():
             self.app.delete()
 
-    def create_pull_secrets(self):
+    def gen_pull_secrets(self) -> list[kubernetes.client.V1Secret]:
         secrets_id_set = set()
         ocr_auths = dict()
 
@@ -65,34 +104,28 @@ class AppResource:
 
             elif crid := container.metadata.get('crid'):  # Osiris Container Registry
                 if crid not in ocr_auths:
-                    ocr_auths[crid] = container.gen_oc_auth_data()
-
-        def create(name, data=None):
-            secret_spec = None
-
-            try:
-                secret_spec = kubernetes.client.V1Secret(
-                    metadata=kubernetes.client.V1ObjectMeta(
-                        name=name,
-                        namespace=self.nsid
-                    ),
-                    type='kubernetes.io/dockerconfigjson',
-                    data=data,
-                )
-                AppResource.core_v1.create_namespaced_secret(namespace=self.nsid, body=secret_spec)
+                    ocr_auths[crid] = container.gen_oc_auth_data(), {
+                        'name': 'pull-secret-' + crid,
+                        'image': f"{container.metadata['repo']}/{container.metadata['image']}",
+                        'registry': env.registry_domain,
+                        'kid': get_signing_key().kid,
+                    }
 
-            except kubernetes.client.exceptions.ApiException as e:
-                if e.status == 409:
-                    AppResource.core_v1.replace_namespaced_secret(
-                        name=name,
-                        namespace=self.nsid,
-                        body=secret_spec
-                    )
-                else:
-                    logging.error(f"Failed to create secret {name}", exc_info=True)
+        secrets = []
 
-            finally:
-                self.pull_secrets.add(name)
+        def create(name, data=None, annotations=None):
+            secrets.append(kubernetes.client.V1Secret(
+                api_version='v1',
+                kind='Secret',
+                metadata=kubernetes.client.V1ObjectMeta(
+                    name=name,
+                    namespace=self.nsid,
+                    annotations=annotations
+                ),
+                type='kubernetes.io/dockerconfigjson',
+                data=data,
+            ))
+            self.pull_secrets.add(name)
 
         for secretid in secrets_id_set:
             user_secret = Secret.objects.get(secretid=secretid)
@@ -104,76 +137,55 @@ class AppResource:
             auth_data = b64encode(auth_data_str.encode()).decode()
             create('pull-secret-' + secretid, data={".dockerconfigjson": auth_data})
 
-        for crid, auth_data in ocr_auths.items():
-            create('pull-secret-' + crid, data={".dockerconfigjson": auth_data})
+        for crid, (auth_data, inputs) in ocr_auths.items():
+            # The token is minted anew on every render, the secret only changes with what it is minted for
+            create('pull-secret-' + crid, data={".dockerconfigjson": auth_data},
+                   annotations={SPEC_HASH_ANNOTATION: spec_hash(inputs)})
 
-    def create_secrets(self) -> None:
-        # Create volume secrets
-        for vol in self.app.volumes.all():
-            if vol.type != 'secret':
-                continue
+        return secrets
 
-            try:
-                user_secret = Secret.objects.get(secretid=vol.metadata.get('secretid'))
-            except Secret.DoesNotExist:
-                continue
+    def gen_secrets(self) -> list[kubernetes.client.V1Secret]:
+        secretids = []
+
+        # Volume secrets
+        for vol in self.volumes:
+            if vol.type == 'secret' and vol.metadata.get('secretid'):
+                secretids.append(vol.metadata['secretid'])
+
+        # Env secrets
+        for container in self.containers:
+            if container.env_secret:
+                secretids.append(container.env_secret.secretid)
+
+        secrets = []
 
-            secret_spec = kubernetes.client.V1Secret(
+        for user_secret in Secret.objects.filter(secretid__in=set(secretids)):
+            # Sent as data rather than string_data, so that applying the same secret again is a no-op
+            data = {k: b64encode(str(v).encode()).decode() for k, v in json_loads(user_secret.data).items()}
+
+            secrets.append(kubernetes.client.V1Secret(
+                api_version='v1',
+                kind='Secret',
                 metadata=kubernetes.client.V1ObjectMeta(
                     name='secret-' + user_secret.secretid,
                     namespace=self.nsid
                 ),
                 type='Opaque',
-                string_data=json_loads(user_secret.data)
-            )
+                data=data
+            ))
 
-            try:
-                AppResource.core_v1.create_namespaced_secret(namespace=self.nsid, body=secret_spec)
-            except kubernetes.client.exceptions.ApiException as e:
-                if e.status == 409:
-                    AppResource.core_v1.replace_namespaced_secret(
-                        name='secret-' + user_secret.secretid,
-                        namespace=self.nsid,
-                        body=secret_spec
-                    )
-                else:
-                    logging.error(f"Failed to create secret secret-{user_secret.secretid}", exc_info=True)
+        return secrets
 
-        # Create env secrets
-        for container in self.app.containers.all():
-            if container.env_secret:
-                try:
-                    user_secret = Secret.objects.get(secretid=container.env_secret.secretid)
-                except Secret.DoesNotExist:
-                    continue
-
-                secret_spec = kubernetes.client.V1Secret(
-                    metadata=kubernetes.client.V1ObjectMeta(
-                        name='secret-' + container.env_secret.secretid,
-                        namespace=self.nsid
-                    ),
-                    type='Opaque',
-                    string_data=json_loads(user_secret.data)
-                )
-
-                try:
-                    secret = AppResource.core_v1.create_namespaced_secret(namespace=self.nsid, body=secret_spec)
-                except kubernetes.client.exceptions.ApiException as e:
-                    if e.status == 409:
-                        secret = AppResource.core_v1.replace_namespaced_secret(
-                            name='secret-' + container.env_secret.secretid,
-                            namespace=self.nsid,
-                            body=secret_spec
-                        )
-                    else:
-                        logging.error(f"Failed to create secret secret-{container.env_secret.secretid}", exc_info=True)
+    def gen_pvcs(self) -> list[kubernetes.client.V1PersistentVolumeClaim]:
+        pvcs = []
 
-    def create_pvc(self) -> None:
         for vol in self.volumes:
             if vol.type not in ('block', 'fs'):
                 continue
 
-            pvc_spec = kubernetes.client.V1PersistentVolumeClaim(
+            pvcs.append(kubernetes.client.V1PersistentVolumeClaim(
+                api_version='v1',
+                kind='PersistentVolumeClaim',
                 metadata=kubernetes.client.V1ObjectMeta(
                     name='vol-' + vol.volid,
                     namespace=self.nsid
@@ -186,14 +198,9 @@ class AppResource:
                     ),
                     storage_class_name="ceph-rbd"
                 )
-            )
-            try:
-                AppResource.core_v1.create_namespaced_persistent_volume_claim(namespace=self.nsid, body=pvc_spec)
-            except kubernetes.client.exceptions.ApiException as e:
-                if e.status == 409:
-                    pass
-                else:
-                    logging.error(f"Failed to create pvc vol-{vol.volid}", exc_info=True)
+            ))
+
+        return pvcs
 
     def delete_pvc(self, del_all=False):
         volumes_to_delete = self.app.metadata.get('volumes_to_del', [])
@@ -369,12 +376,12 @@ class AppResource:
                 )
             )
 
-    def create_deployment(self) -> kubernetes.client.V1Deployment:
+    def gen_deployment(self) -> kubernetes.client.V1Deployment:
         main_containers = [self.main_container]
         sidecar_containers = [c for c in self.containers if c.type == 'sidecar']
         init_containers = [c for c in self.containers if c.type == 'init']
 
-        deployment = kubernetes.client.V1Deployment(
+        return kubernetes.client.V1Deployment(
             api_version="apps/v1",
             kind="Deployment",
             metadata=kubernetes.client.V1ObjectMeta(
@@ -406,18 +413,7 @@ class AppResource:
             )
         )
 
-        try:
-            return AppResource.apps_v1.create_namespaced_deployment(namespace=self.nsid, body=deployment)
-        except kubernetes.client.exceptions.ApiException as e:
-            if e.status == 409:
-                return AppResource.apps_v1.replace_namespaced_deployment(name='app-' + self.app.appid,
-                                                                         namespace=self.nsid,
-                                                                         body=deployment
-                                                                         )
-            else:
-                logging.error(f"Failed to create deployment app-{self.app.appid}", exc_info=True)
-
-    def create_service(self):
+    def gen_service(self) -> kubernetes.client.V1Service:
         port_config = {
             'port': self.main_container.port,
             'protocol': self.main_container.port_protocol.upper(),
@@ -427,7 +423,9 @@ class AppResource:
         if self.app.connection_protocol in ('tcp', 'udp'):
             port_config['node_port'] = self.app.connection_port
 
-        service_spec = kubernetes.client.V1Service(
+        return kubernetes.client.V1Service(
+            api_version='v1',
+            kind='Service',
             metadata=kubernetes.client.V1ObjectMeta(
                 name=f'svc-{self.app.appid}',
                 namespace=self.nsid,
@@ -441,18 +439,7 @@ class AppResource:
             )
         )
 
-        try:
-            AppResource.core_v1.create_namespaced_service(namespace=self.nsid, body=service_spec)
-        except kubernetes.client.exceptions.ApiException as e:
-            if e.status == 409:
-                AppResource.core_v1.replace_namespaced_service(name=f'svc-{self.app.appid}',
-                                                               namespace=self.nsid,
-                                                               body=service_spec
-                                                               )
-            else:
-                logging.error(f"Failed to create service svc-{self.app.appid}", exc_info=True)
-
-    def create_fw_rules(self):
+    def gen_fw_rules(self) -> list[dict]:
         if self.app.connection_protocol == 'http' and not self.app.ingress.pass_tls:
             ip_rules = {
                 "apiVersion": "traefik.io/v1alpha1",
@@ -491,42 +478,12 @@ class AppResource:
 
                 middlewares.append(nyu_only)
 
-            for middleware in middlewares:
-                try:
-                    AppResource.custom_objects.create_namespaced_custom_object(
-                        group="traefik.io",
-                        version="v1alpha1",
-                        namespace=self.nsid,
-                        plural="middlewares",
-                        body=middleware
-                    )
-                except kubernetes.client.exceptions.ApiException as e:
-                    if e.status == 409:
-                        existing = AppResource.custom_objects.get_namespaced_custom_object(
-                            group="traefik.io",
-                            version="v1alpha1",
-                            namespace=self.nsid,
-                            plural="middlewares",
-                            name=middleware["metadata"]["name"]
-                        )
-
-                        middleware["metadata"]["resourceVersion"] = existing["metadata"]["resourceVersion"]
-
-                        AppResource.custom_objects.replace_namespaced_custom_object(
-                            group="traefik.io",
-                            version="v1alpha1",
-                            namespace=self.nsid,
-                            plural="middlewares",
-                            name=middleware["metadata"]["name"],
-                            body=middleware
-                        )
-                    else:
-                        logging.error(f"Failed to create middleware {middleware['metadata']['name']}", exc_info=True)
+            return middlewares
 
         else:  # TODO TCP/UDP LB rules
-            pass
+            return []
 
-    def create_route(self):
+    def gen_route(self) -> dict | None:
         if self.app.connection_protocol != 'http' or self.app.ingress.pass_tls:
             return None
 
@@ -565,124 +522,70 @@ class AppResource:
         if self.ip_rule.nyu_only:
             ingress_route['spec']['routes'][0]['middlewares'].append({"name": "nyu-only-" + self.app.appid})
 
-        try:
-            AppResource.custom_objects.create_namespaced_custom_object(group="traefik.io",
-                                                                       version="v1alpha1",
-                                                                       namespace=self.nsid,
-                                                                       plural="ingressroutes",
-                                                                       body=ingress_route)
-        except kubernetes.client.exceptions.ApiException as e:
-            if e.status == 409:
-                existing = AppResource.custom_objects.get_namespaced_custom_object(
-                    group="traefik.io",
-                    version="v1alpha1",
-                    namespace=self.nsid,
-                    plural="ingressroutes",
-                    name=ingress_route["metadata"]["name"]
-                )
-
-                ingress_route["metadata"]["resourceVersion"] = existing["metadata"]["resourceVersion"]
+        return ingress_route
 
-                AppResource.custom_objects.replace_namespaced_custom_object(
-                    group="traefik.io",
-                    version="v1alpha1",
-                    namespace=self.nsid,
-                    plural="ingressroutes",
-                    name=ingress_route["metadata"]["name"],
-                    body=ingress_route
-                )
-            else:
-                logging.error(f"Failed to create route-{self.app.appid}", exc_info=True)
-
-    def create_autoscaler(self):
+    def gen_autoscaler(self) -> dict | None:
         scalers = self.app.scaler.scalers
 
-        if not scalers:  # Delete autoscaler if no scalers are defined
-            try:
-                AppResource.custom_objects.delete_namespaced_custom_object(name="scaler-" + self.app.appid,
-                                                                           group="keda.sh",
-                                                                           version="v1alpha1",
-                                                                           namespace=self.nsid,
-                                                                           plural="scaledobjects")
-            except kubernetes.client.exceptions.ApiException as e:
-                if e.status == 404:
-                    pass
-                else:
-                    logging.error(f"Failed to delete autoscaler scaler-{self.app.appid}", exc_info=True)
+        if not scalers:
+            return None
 
-        else:
-            triggers = lambda t, v: {
-                "type": t,
-                "metadata": {
-                    "type": "Utilization",
-                    "value": str(v),
-                }
+        triggers = lambda t, v: {
+            "type": t,
+            "metadata": {
+                "type": "Utilization",
+                "value": str(v),
             }
+        }
 
-            scaled_object = {
-                "apiVersion": "keda.sh/v1alpha1",
-                "kind": "ScaledObject",
-                "metadata": {
-                    "name": "scaler-" + self.app.appid,
-                    "namespace": self.nsid
+        scaled_object = {
+            "apiVersion": "keda.sh/v1alpha1",
+            "kind": "ScaledObject",
+            "metadata": {
+                "name": "scaler-" + self.app.appid,
+                "namespace": self.nsid
+            },
+            "spec": {
+                "scaleTargetRef": {
+                    "name": "app-" + self.app.appid,
+                    "kind": "Deployment"
                 },
-                "spec": {
-                    "scaleTargetRef": {
-                        "name": "app-" + self.app.appid,
-                        "kind": "Deployment"
-                    },
-                    "minReplicaCount": self.app.scaler.min_replicas,
-                    "maxReplicaCount": self.app.scaler.max_replicas,
-                    "pollingInterval": 15,
-                    "cooldownPeriod": 60,
-                    "triggers": [triggers(scaler['type'], round(scaler['target'] * 2, 1)) for scaler in scalers],
-                    "advanced": {
-                        "restoreToOriginalReplicaCount": True,
-                        "horizontalPodAutoscalerConfig": {
-                            "behavior": {
-                                "scaleDown": {
-                                    "stabilizationWindowSeconds": self.app.scaler.scaledown_stb_window,
-                                    "policies": [
-                                        {
-                                            "type": "Percent",
-                                            "value": 100,
-                                            "periodSeconds": 10
-                                        }
-                                    ]
-                                },
-                                "scaleUp": {
-                                    "stabilizationWindowSeconds": self.app.scaler.scaleup_stb_window,
-                                    "policies": [
-                                        {
-                                            "type": "Percent",
-                                            "value": 100,
-                                            "periodSeconds": 10
-                                        }
-                                    ]
-                                }
+                "minReplicaCount": self.app.scaler.min_replicas,
+                "maxReplicaCount": self.app.scaler.max_replicas,
+                "pollingInterval": 15,
+                "cooldownPeriod": 60,
+                "triggers": [triggers(scaler['type'], round(scaler['target'] * 2, 1)) for scaler in scalers],
+                "advanced": {
+                    "restoreToOriginalReplicaCount": True,
+                    "horizontalPodAutoscalerConfig": {
+                        "behavior": {
+                            "scaleDown": {
+                                "stabilizationWindowSeconds": self.app.scaler.scaledown_stb_window,
+                                "policies": [
+                                    {
+                                        "type": "Percent",
+                                        "value": 100,
+                                        "periodSeconds": 10
+                                    }
+                                ]
+                            },
+                            "scaleUp": {
+                                "stabilizationWindowSeconds": self.app.scaler.scaleup_stb_window,
+                                "policies": [
+                                    {
+                                        "type": "Percent",
+                                        "value": 100,
+                                        "periodSeconds": 10
+                                    }
+                                ]
                             }
                         }
                     }
                 }
             }
+        }
 
-            try:
-                AppResource.custom_objects.create_namespaced_custom_object(group="keda.sh",
-                                                                           version="v1alpha1",
-                                                                           namespace=self.nsid,
-                                                                           plural="scaledobjects",
-                                                                           body=scaled_object)
-
-            except kubernetes.client.exceptions.ApiException as e:
-                if e.status == 409:
-                    AppResource.custom_objects.replace_namespaced_custom_object(name="scaler-" + self.app.appid,
-                                                                                group="keda.sh",
-                                                                                version="v1alpha1",
-                                                                                namespace=self.nsid,
-                                                                                plural="scaledobjects",
-                                                                                body=scaled_object)
-                else:
-                    logging.error(f"Failed to create autoscaler scaler-{self.app.appid}", exc_info=True)
+        return scaled_object
 
     def redeploy(self):
         try:
@@ -0,0 +1,53 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..infra.models import Namespace, Volume
+from .models import AppFW, Container, ContainerApp, Ingress, IngressHosts, Scaler
+
+
+class ContainerAppInfoQueriesTest(TestCase):
+    def setUp(self):
+        self.namespace = Namespace.objects.create(nsid='ns-test', name='test')
+
+    def create_app(self, i: int) -> ContainerApp:
+        ingress = Ingress.objects.create()
+        ingress.hosts.add(IngressHosts.objects.create(host=f'app-{i}.example.com'))
+
+        app = ContainerApp.objects.create(
+            namespace=self.namespace,
+            name=f'app-{i}',
+            slug=f'app-{i}',
+            ingress=ingress,
+            scaler=Scaler.objects.create(),
+            ip_rule=AppFW.objects.create(precedence='deny'),
+            connection_port=8000 + i,
+            connection_protocol='http',
+        )
+        app.containers.add(
+            Container.objects.create(type='main', image='nginx', cpu=0.5, memory=512),
+            Container.objects.create(type='sidecar', image='redis', cpu=0.25, memory=256),
+        )
+        app.volumes.add(Volume.objects.create(name=f'vol-{i}', type='fs', size=1, mount_path='/data',
+                                              namespace=self.namespace))
+        return app
+
+    @staticmethod
+    def serialize() -> list[dict]:
+        return [app.info() for app in ContainerApp.objects.with_info()]
+
+    def test_info_queries_do_not_grow_with_apps(self):
+        self.create_app(0)
+
+        with CaptureQueriesContext(connection) as single:
+            self.assertEqual(len(self.serialize()), 1)
+
+        for i in range(1, 10):
+            self.create_app(i)
+
+        with self.assertNumQueries(len(single)):
+            apps = self.serialize()
+
+        self.assertEqual(len(apps), 10)
+        self.assertTrue(all(app['main'] and app['sidecar'] and app['volumes'] for app in apps))
+        self.assertTrue(all(app['ingress']['hosts'] for app in apps))
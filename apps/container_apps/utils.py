@@ -2,6 +2,8 @@ import logging
 import re
 import ipaddress
 
+from datetime import datetime
+
 from core.settings import env
 
 from .models import ContainerApp, IngressHosts
@@ -555,27 +557,37 @@ def under_limits(spec: dict, user) -> [bool, dict]:
     })
 
 
-def process_events(events):
+def process_event(event: dict) -> dict:
     """
-    Process kubernetes events and sort them by timestamp in descending order
+    Process a raw kubernetes event as received from a list or watch
     """
-    event_messages = []
-    for e in events.items:
-        if e.reason == 'ScalingReplicaSet':
-            msg = e.message.split()
-            event_messages.append({
-                'message': ' '.join(msg[:2] + ['app instances'] + msg[5:]),
-                'time': e.last_timestamp.isoformat() if e.last_timestamp else None
-            })
-        else:
-            event_messages.append({
-                'reason': e.reason,
-                'message': e.message,
-                'time': e.last_timestamp.isoformat() if e.last_timestamp else None
-            })
+    last_timestamp = event.get('lastTimestamp')
+    time = datetime.fromisoformat(last_timestamp).isoformat() if last_timestamp else None
+    reason = event.get('reason')
+    message = event.get('message') or ''
+
+    if reason == 'ScalingReplicaSet':
+        msg = message.split()
+        return {
+            'id': event['metadata']['uid'],
+            'message': ' '.join(msg[:2] + ['app instances'] + msg[5:]),
+            'time': time
+        }
 
+    return {
+        'id': event['metadata']['uid'],
+        'reason': reason,
+        'message': message,
+        'time': time
+    }
+
+
+def process_events(events: list[dict]) -> list[dict]:
+    """
+    Process raw kubernetes events and sort them by timestamp in descending order
+    """
     return sorted(
-        event_messages,
+        [process_event(e) for e in events],
         key=lambda x: (x['time'] is None, x['time'] or ''),
         reverse=True
     )
@@ -745,73 +757,79 @@ async def fetch_metric(client, url, metric_name, query, params):
         return metric_name, []
 
 
-async def fetch_usage(client, url, query: str, metric_name: str) -> float:
+async def fetch_usage_by_service(client, url, query: str, metric_name: str) -> dict[str, float]:
+    """
+    Run a vectorised PromQL query grouped `by (service)` and return {service: value}
+    """
     try:
         response = await client.get(url, params={'query': query}, timeout=10.0)
         response.raise_for_status()
         data = response.json()
         result = data.get('data', {}).get('result', [])
-        if not result:
-            return 0
-        return float(result[0]['value'][1])
+        return {r['metric'].get('service', ''): float(r['value'][1]) for r in result}
 
     except Exception as e:
         logging.error(f"Error fetching {metric_name}: {str(e)}")
         raise e
 
 
-async def fetch_metric_server_stat(client, url: str) -> dict:
-    try:
-        response = await client.get(url, timeout=5)
-        response.raise_for_status()
-        metrics = response.json()
+def process_pod_metrics(metrics: dict) -> dict:
+    """
+    Process a metrics.k8s.io PodMetrics object into per container and total usage
+    """
+    result = {
+        'main': {},
+        'sidecar': {},
+        'init': {},
+        'total': {
+            'cpu': 0,
+            'memory': 0
+        },
+    }
 
-        result = {
-            'main': {},
-            'sidecar': {},
-            'init': {},
-            'total': {},
-        }
+    if metrics.get('containers') is None:
+        return result
 
-        if metrics.get('containers') is None:
-            return result
+    total_cpu = 0
+    total_memory = 0
 
-        total_cpu = 0
-        total_memory = 0
+    for container in metrics['containers']:
+        usage = {
+            'cpu': round(cpu_to_cores(container['usage']['cpu']), 4),
+            'memory': round(memory_to_mb(container['usage']['memory'], mib=True), 4)
+        }
 
-        for container in metrics['containers']:
-            usage = {
-                'cpu': round(cpu_to_cores(container['usage']['cpu']), 4),
-                'memory': round(memory_to_mb(container['usage']['memory'], mib=True), 4)
-            }
+        if container['name'] == 'main':
+            result['main'] = usage
 
-            if container['name'] == 'main':
-                result['main'] = usage
+        elif container['name'] == 'sidecar':
+            result['sidecar'] = usage
 
-            elif container['name'] == 'sidecar':
-                result['sidecar'] = usage
+        elif container['name'] == 'init':
+            result['init'] = usage
 
-            elif container['name'] == 'init':
-                result['init'] = usage
+        total_cpu += usage['cpu']
+        total_memory += usage['memory']
 
-            total_cpu += usage['cpu']
-            total_memory += usage['memory']
+    result['total']['cpu'] = total_cpu
+    result['total']['memory'] = total_memory
 
-        result['total']['cpu'] = total_cpu
-        result['total']['memory'] = total_memory
+    return result
 
-        return result
 
-    except Exception:
-        return {
-            'main': {},
-            'sidecar': {},
-            'init': {},
-            'total': {
-                'cpu': 0,
-                'memory': 0
-            },
-        }
+async def fetch_pod_metrics(client, url: str, appids: list[str]) -> list[dict]:
+    """
+    List metrics.k8s.io PodMetrics of all pods of the given apps in a namespace in one call
+    """
+    try:
+        params = {'labelSelector': f"appid in ({','.join(appids)})"}
+        response = await client.get(url, params=params, timeout=5)
+        response.raise_for_status()
+        return response.json().get('items', [])
+
+    except Exception as e:
+        logging.error(f"Error fetching pod metrics: {str(e)}")
+        return []
 
 
 def get_state_from_conditions(k8s_conditions: list, default='unknown') -> str:
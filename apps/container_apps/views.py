@@ -29,7 +29,7 @@ def container_apps_create(request, nsid):
 @namespaced
 def container_apps_view(request, nsid, appid):
     try:
-        app = ContainerApp.objects.get(appid=appid)
+        app = ContainerApp.objects.with_info().get(appid=appid)
     except ContainerApp.DoesNotExist:
         return render(request, "pages/404-app.html", status=404)
 
@@ -54,7 +54,7 @@ def container_apps_view(request, nsid, appid):
 @namespaced
 def container_apps_edit(request, nsid, appid):
     try:
-        app = ContainerApp.objects.get(appid=appid)
+        app = ContainerApp.objects.with_info().get(appid=appid)
     except ContainerApp.DoesNotExist:
         return render(request, "pages/404-app.html", status=404)
 
@@ -1,24 +1,98 @@
 import logging
+import time
 
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.utils import timezone
+from django.core.cache import cache
 from base64 import b64decode
+from hashlib import sha256
 
 from core.utils import error_message
-from ..api.models import AccessToken
-from .models import ContainerRegistry
+from ..api.models import AccessToken, access_token_version_key
+from ..infra.models import ns_roles_version_key
+from .models import ContainerRegistry, registry_version_key
 
 from .utils import generate_auth_token, get_registry_permissions
 
 
+TOKEN_LIFETIME = 3600  # Seconds a registry token is valid for
+TOKEN_CACHE_TTL = 60  # Seconds an issued token is handed out again for the same key and scope
+
+
+def token_cache_key(psw: str, scope: str) -> str:
+    return 'registry_token_' + sha256(f'{psw}\n{scope}'.encode()).hexdigest()
+
+
+def token_versions(keyid, user_id, repo: str | None = None) -> tuple[int, ...]:
+    """
+    Invalidation versions of the access key, of the namespace roles of its user and of the repo the token is for
+    """
+    keys = [access_token_version_key(keyid), ns_roles_version_key(user_id)]
+    if repo:
+        keys.append(registry_version_key(repo))
+
+    versions = cache.get_many(keys)
+    return tuple(versions.get(key, 0) for key in keys)
+
+
+def token_lifetime(key: AccessToken) -> int:
+    """
+    Seconds a token issued for the key is valid for, which never reach past the expiration of the key
+    """
+    if key.expiration is None:
+        return TOKEN_LIFETIME
+    return max(0, min(TOKEN_LIFETIME, int(key.expiration.timestamp() - time.time())))
+
+
+def get_cached_token(cache_key: str) -> tuple[str, int] | None:
+    """
+    Returns a token issued for the same key and scope and its remaining lifetime, unless the key, the roles of its
+    user or the repo changed since, or the token ran out with the key
+    """
+    entry = cache.get(cache_key)
+    if entry is None:
+        return None
+
+    expires_in = int(entry['expires_at'] - time.time())
+    if expires_in <= 0:
+        return None
+
+    if token_versions(entry['keyid'], entry['user_id'], entry.get('repo')) != entry['versions']:
+        return None
+
+    AccessToken.touch(entry['keyid'])
+    return entry['token'], expires_in
+
+
+def cache_token(cache_key: str, token: str, key: AccessToken, versions: tuple[int, ...], repo: str | None,
+                lifetime: int) -> None:
+    # Capped at the key's expiration through the lifetime, so a cached token never outlives its key
+    cache.set(cache_key, {
+        'token': token,
+        'expires_at': time.time() + lifetime,
+        'keyid': key.pk,
+        'user_id': key.user_id,
+        'repo': repo,
+        'versions': versions,
+    }, timeout=min(TOKEN_CACHE_TTL, lifetime))
+
+
+def token_response(token: str, expires_in: int = TOKEN_LIFETIME) -> JsonResponse:
+    return JsonResponse({
+        'token': token,
+        'access_token': token,
+        'expires_in': expires_in,
+    })
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def registry_auth(request):
     """
     Implements Registry authentication and authorization.
-    If public repo, it skips checking for authorization and generate a token with only pull permissions
+    If public repo, it skips checking for authorization and generate a token with only pull permissions.
+    Tokens issued to an access key are reused for the same scope for a short while, since clients ask for one per layer
     """
     auth_header = request.headers.get('Authorization', '')
 
@@ -30,23 +104,27 @@ def registry_auth(request):
         except Exception:
             return '', ''
 
+    user, psw = decode_creds()
+    scope = request.GET.get('scope', '')
+    cache_key = token_cache_key(psw, scope)
+
     def check_auth() -> tuple[bool, [AccessToken | None], [str | None]]:
-        try:
-            user, psw = decode_creds()
-            _key = AccessToken.objects.get(key=psw)
-            if not _key or user != 'osiris':
-                return False, None, 'Permission denied'
-            if not any(_scope in ('container-registry', 'global') for _scope in _key.scopes):
-                return False, _key, 'Token has inadequate permissions'
-            _key.last_used = timezone.now()
-            _key.save()
-            return True, _key, None
-        except AccessToken.DoesNotExist:
+        _key = AccessToken.get_by_key(psw) if psw else None
+        if not _key or user != 'osiris':
             return False, None, 'Permission denied'
+        if _key.is_expired():
+            return False, _key, 'Token has expired'
+        if not any(_scope in ('container-registry', 'global') for _scope in _key.scopes):
+            return False, _key, 'Token has inadequate permissions'
+        _key.update_last_used()
+        return True, _key, None
 
     try:
+        if user == 'osiris' and psw and (cached := get_cached_token(cache_key)):
+            return token_response(*cached)
+
         # Authorization
-        if scope := request.GET.get('scope'):
+        if scope:
             r_type, r_name, r_actions = scope.split(':')
             r_name, sub_repo = r_name.split('/', 1)
             repo_path = f'{r_name}/{sub_repo}' if sub_repo else r_name
@@ -57,37 +135,39 @@ def registry_auth(request):
             if r_name == '*':
                 return JsonResponse({'message': 'Permission denied'}, status=403)
 
-            repo = ContainerRegistry.objects.get(repo=r_name)
+            repo = ContainerRegistry.objects.select_related('namespace').get(repo=r_name)
 
             auth_valid, key, err = check_auth()
 
             if repo.public and not auth_valid:
-                token = generate_auth_token('repository', repo_path, ['pull'])
-            else:
-                if not auth_valid:
-                    return JsonResponse({'errors': [{'code': 'UNAUTHORIZED', 'message': err}]}, status=401)
+                return token_response(generate_auth_token('repository', repo_path, ['pull']))
 
-                ns_role = repo.get_role(key.user)
-                allowed_actions = get_registry_permissions(ns_role)
+            if not auth_valid:
+                return JsonResponse({'errors': [{'code': 'UNAUTHORIZED', 'message': err}]}, status=401)
+
+            # Before the roles are read, so no change slips through
+            versions = token_versions(key.pk, key.user_id, r_name)
+            ns_role = repo.get_role(key.user)
+            allowed_actions = get_registry_permissions(ns_role)
 
-                if not key.can_write:
-                    allowed_actions = [a for a in allowed_actions if a != 'push']
+            if not key.can_write:
+                allowed_actions = [a for a in allowed_actions if a != 'push']
 
-                token = generate_auth_token(r_type, repo_path, allowed_actions)
+            lifetime = token_lifetime(key)
+            token = generate_auth_token(r_type, repo_path, allowed_actions, seconds=lifetime)
 
         # Authentication
         else:
-            auth_valid, _, err = check_auth()
+            auth_valid, key, err = check_auth()
             if not auth_valid:
                 return JsonResponse({'errors': [{'code': 'UNAUTHORIZED', 'message': err}]}, status=401)
 
-            token = generate_auth_token()
+            versions = token_versions(key.pk, key.user_id)
+            lifetime = token_lifetime(key)
+            token = generate_auth_token(seconds=lifetime)
 
-        return JsonResponse({
-            'token': token,
-            'access_token': token,
-            'expires_in': 3600,
-        })
+        cache_token(cache_key, token, key, versions, r_name if scope else None, lifetime)
+        return token_response(token, lifetime)
 
     except (AccessToken.DoesNotExist, ContainerRegistry.DoesNotExist):
         return JsonResponse({'errors': [{'code': 'UNAUTHORIZED', 'message': 'Permission denied'}]}, status=401)
@@ -0,0 +1,58 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from core.settings import env
+from core.utils import generate_kid
+
+EC_ALGORITHMS = {
+    'secp256r1': 'ES256',
+    'secp384r1': 'ES384',
+    'secp521r1': 'ES512',
+}
+
+
+class SigningKeyError(Exception):
+    pass
+
+
+class SigningKey:
+    """
+    Private key the registry tokens are signed with, parsed once.
+    RSA keys sign with RS256. EC keys sign with ES256/384/512 depending on their curve, which is much faster to mint
+    with; the registry only needs the matching public key in its token auth root cert bundle.
+    """
+
+    def __init__(self, pem: bytes | str):
+        if isinstance(pem, str):
+            pem = pem.encode()
+
+        try:
+            self.key = serialization.load_pem_private_key(pem, password=None)
+        except (ValueError, TypeError) as e:
+            raise SigningKeyError(f"Failed to load signing key: {e}")
+
+        if isinstance(self.key, rsa.RSAPrivateKey):
+            self.key_type = 'RSA'
+            self.algorithm = 'RS256'
+        elif isinstance(self.key, ec.EllipticCurvePrivateKey) and self.key.curve.name in EC_ALGORITHMS:
+            self.key_type = 'EC'
+            self.algorithm = EC_ALGORITHMS[self.key.curve.name]
+        else:
+            raise SigningKeyError("Signing key must be RSA or EC on P-256, P-384 or P-521")
+
+        self.kid = generate_kid(pem, self.key_type)
+
+
+SIGNING_KEY = None  # Loaded on first use
+
+
+def get_signing_key() -> SigningKey:
+    """
+    The registry signing key from the environment
+    """
+    global SIGNING_KEY
+    if SIGNING_KEY is None:
+        if not env.registry_signing_key:
+            raise SigningKeyError("Registry signing key is not configured")
+        SIGNING_KEY = SigningKey(env.registry_signing_key)
+    return SIGNING_KEY
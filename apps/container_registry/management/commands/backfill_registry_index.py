@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ...models import ContainerRegistry
+from ...tasks import reconcile_registry_index
+
+
+class Command(BaseCommand):
+    help = "Index the images of registries created before the image index, so that their stats have data to read"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help="Queue the crawls on the workers instead")
+
+    def handle(self, *args, **options):
+        crids = list(ContainerRegistry.objects.filter(state='active', images__isnull=True)
+                     .values_list('crid', flat=True).distinct())
+
+        for crid in crids:
+            if options['queue']:
+                reconcile_registry_index.delay(crid=crid)
+            else:
+                reconcile_registry_index(crid=crid)
+
+        self.stdout.write(f"{len(crids)} registries {'queued' if options['queue'] else 'indexed'}")
@@ -0,0 +1,61 @@
+import time
+
+from jwt import encode
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from django.core.management.base import BaseCommand
+
+from core.settings import env
+from ...keys import SigningKey
+
+CLAIM = {
+    'iss': 'OCR',
+    'sub': '',
+    'aud': 'OCR',
+    'access': [{'type': 'repository', 'name': 'bench/image', 'actions': ['pull']}],
+}
+
+
+def to_pem(key) -> bytes:
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+class Command(BaseCommand):
+    help = "Measure how many registry tokens per second can be minted with each way of signing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help="Tokens minted per case")
+
+    def run(self, name: str, count: int, sign) -> None:
+        start = time.perf_counter()
+        for _ in range(count):
+            sign()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{name:<32} {count / elapsed:>10.0f} tokens/s {elapsed / count * 1e6:>10.1f} us/token")
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        if env.registry_signing_key:
+            rsa_pem = env.registry_signing_key
+            if isinstance(rsa_pem, str):
+                rsa_pem = rsa_pem.encode()
+            self.stdout.write("Using the configured registry signing key")
+        else:
+            rsa_pem = to_pem(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+            self.stdout.write("No registry signing key configured, using a generated RSA 2048 key")
+
+        rsa_key = SigningKey(rsa_pem)
+        ec_key = SigningKey(to_pem(ec.generate_private_key(ec.SECP256R1())))
+
+        self.run("PEM parsed per token (before)", count,
+                 lambda: encode(CLAIM, rsa_pem, algorithm=rsa_key.algorithm, headers={'kid': rsa_key.kid}))
+        self.run(f"Parsed key, {rsa_key.algorithm}", count,
+                 lambda: encode(CLAIM, rsa_key.key, algorithm=rsa_key.algorithm, headers={'kid': rsa_key.kid}))
+        self.run(f"Parsed key, {ec_key.algorithm}", count,
+                 lambda: encode(CLAIM, ec_key.key, algorithm=ec_key.algorithm, headers={'kid': ec_key.kid}))
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('container_registry', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistryImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sub', models.CharField(max_length=255)),
+                ('tag', models.CharField(max_length=128)),
+                ('digest', models.CharField(max_length=100)),
+                ('config_digest', models.CharField(blank=True, default='', max_length=100)),
+                ('size', models.BigIntegerField(default=0)),
+                ('pushed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('registry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='container_registry.containerregistry')),
+            ],
+            options={
+                'db_table': 'container_registry_image',
+                'ordering': ['sub', 'tag'],
+                'unique_together': {('registry', 'sub', 'tag')},
+            },
+        ),
+    ]
@@ -4,7 +4,10 @@ import logging
 import httpx
 
 from asgiref.sync import async_to_sync, sync_to_async
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 
 from core.model_fields import UUID7StringField
@@ -12,7 +15,8 @@ from core.utils import similar_time
 from ..infra.models import Namespace
 
 from core.settings import env
-from .utils import get_sub_repositories, get_tags, get_manifest, get_blob_digests, generate_auth_token, delete_blob
+from .utils import get_sub_repositories, get_tags, get_manifest, get_manifest_cached, get_blob_digests, \
+    generate_auth_token, delete_blob, delete_with_retry, manifest_size, STAT_CONCURRENCY, DELETE_PROGRESS_EVERY
 
 from ..infra.constants import R_STATES, DOCKER_HEADERS
 
@@ -58,44 +62,139 @@ class ContainerRegistry(models.Model):
         }
 
     def stat(self) -> list[dict]:
-        async def stat_async() -> list:
+        """
+        Images of the registry with their tags and sizes, from the registry index
+        """
+        result = {}
+        for image in self.images.all():
+            item = result.setdefault(image.sub, {'sub': image.sub, 'tags': [], 'size': 0})
+            item['tags'].append({
+                'name': image.tag,
+                'size': image.size,
+                'digest': image.config_digest,
+            })
+            item['size'] += image.size
+
+        return list(result.values())
+
+    def crawl(self) -> list[dict] | None:
+        """
+        Images of the registry as the registry itself has them, or None if it could not be crawled.
+        Sub-repos and tags are crawled concurrently over one client, and manifests are cached by digest
+        """
+        async def crawl_async() -> list | None:
             sub_repos = await get_sub_repositories(self.repo)
-            result = []
+            if not sub_repos:
+                return []
+
+            tokens = await sync_to_async(RepoToken.get_many)(self, [f'{self.repo}/{sub}' for sub in sub_repos])
+            semaphore = asyncio.Semaphore(STAT_CONCURRENCY)
+
+            async with httpx.AsyncClient(headers=DOCKER_HEADERS, verify=False,
+                                         limits=httpx.Limits(max_connections=STAT_CONCURRENCY)) as client:
+
+                async def crawl_tag(repo_path: str, headers: dict, tag: str) -> dict:
+                    async with semaphore:
+                        manifest = await get_manifest_cached(client, repo_path, tag, headers)
+
+                    return {
+                        'name': tag,
+                        'size': manifest_size(manifest),
+                        'digest': manifest.get('config', {}).get('digest', ''),
+                        'reference': manifest.get('reference', ''),
+                    }
+
+                async def crawl_sub(sub: str) -> dict | None:
+                    repo_path = f'{self.repo}/{sub}'
+                    headers = {'Authorization': f"Bearer {tokens[repo_path].token}"}
+
+                    async with semaphore:
+                        tags = await get_tags(client, repo_path, headers)
+                    if not tags:
+                        return None
+
+                    tag_stats = await asyncio.gather(*[crawl_tag(repo_path, headers, tag) for tag in tags])
+                    return {
+                        'sub': sub,
+                        'tags': list(tag_stats),
+                        'size': sum(tag['size'] for tag in tag_stats),
+                    }
 
-            for sub in sub_repos:
-                repo_path = f'{self.repo}/{sub}'
-                token, _ = await sync_to_async(RepoToken.get_or_create)(registry=self, path=repo_path)
-                headers = {**DOCKER_HEADERS, 'Authorization': f"Bearer {token.token}"}
                 try:
-                    async with httpx.AsyncClient(headers=headers, verify=False) as client:
-                        item = {
-                            'sub': sub,
-                            'tags': [],
-                            'size': 0
-                        }
-                        tags = await get_tags(client, repo_path)
-                        if tags:
-                            for tag in tags:
-                                manifest = await get_manifest(client, repo_path, tag)
-                                config = manifest.get('config', {})
-                                layers = manifest.get('layers', [])
-                                size = sum([layer.get('size', 0) for layer in layers]) + config.get('size', 0)
-                                item['tags'].append({
-                                    'name': tag,
-                                    'size': size,
-                                    'digest': config.get('digest', ''),
-                                })
-                                item['size'] += size
-                            result.append(item)
-
+                    items = await asyncio.gather(*[crawl_sub(sub) for sub in sub_repos])
                 except Exception as e:
                     logging.exception(e)
-                    return []
+                    return None
+
+            return [item for item in items if item]
 
-            return result
+        return async_to_sync(crawl_async)()
 
-        resp = async_to_sync(stat_async)()
-        return resp
+    def index_image(self, sub: str, tag: str, digest: str, pushed_at=None) -> None:
+        """
+        Add or update a tag in the registry index, from the manifest it was pushed with
+        """
+        async def fetch_manifest() -> dict:
+            repo_path = f'{self.repo}/{sub}'
+            token, _ = await sync_to_async(RepoToken.get_or_create)(registry=self, path=repo_path)
+            headers = {**DOCKER_HEADERS, 'Authorization': f"Bearer {token.token}"}
+            async with httpx.AsyncClient(headers=headers, verify=False) as client:
+                return await get_manifest_cached(client, repo_path, digest)
+
+        manifest = async_to_sync(fetch_manifest)()
+        if not manifest.get('reference'):
+            raise ValueError(f"Manifest {digest} of {self.repo}/{sub} not found")
+
+        RegistryImage.objects.update_or_create(
+            registry=self, sub=sub, tag=tag,
+            defaults={
+                'digest': manifest['reference'],
+                'config_digest': manifest.get('config', {}).get('digest', ''),
+                'size': manifest_size(manifest),
+                'pushed_at': pushed_at or timezone.now(),
+            }
+        )
+
+    def reindex(self) -> bool:
+        """
+        Re-crawl the registry and repair the index where it drifted, returns whether the crawl succeeded
+        """
+        crawled = self.crawl()
+        if crawled is None:
+            return False
+
+        indexed = {(image.sub, image.tag): image for image in self.images.all()}
+        now = timezone.now()
+        to_create = []
+        to_update = []
+
+        for item in crawled:
+            for tag in item['tags']:
+                if not tag['reference']:
+                    continue
+
+                fields = {
+                    'digest': tag['reference'],
+                    'config_digest': tag['digest'],
+                    'size': tag['size'],
+                }
+                image = indexed.pop((item['sub'], tag['name']), None)
+
+                if image is None:
+                    to_create.append(RegistryImage(registry=self, sub=item['sub'], tag=tag['name'], **fields))
+                elif any(getattr(image, field) != value for field, value in fields.items()):
+                    for field, value in fields.items():
+                        setattr(image, field, value)
+                    image.updated_at = now  # bulk_update skips auto_now
+                    to_update.append(image)
+
+        with transaction.atomic():
+            RegistryImage.objects.bulk_create(to_create)
+            RegistryImage.objects.bulk_update(to_update, ['digest', 'config_digest', 'size', 'updated_at'])
+            # Whatever is left is gone from the registry
+            RegistryImage.objects.filter(pk__in=[image.pk for image in indexed.values()]).delete()
+
+        return True
 
     def delete_image(self, image, tag) -> bool:
         async def delete_image_async() -> bool:
@@ -119,8 +218,65 @@ class ContainerRegistry(models.Model):
                 return False
 
         deleted = async_to_sync(delete_image_async)()
+        if deleted:
+            self.images.filter(sub=image, tag=tag).delete()
         return deleted
 
+    def purge(self) -> dict:
+        """
+        Delete every image of the registry. Manifests and blobs shared between tags are only deleted once per sub-repo,
+        and deletions run concurrently. Returns the number of deleted and failed objects
+        """
+        crawled = self.crawl()
+        if crawled is not None:
+            manifests = {(item['sub'], tag['reference'])
+                         for item in crawled for tag in item['tags'] if tag['reference']}
+        else:  # Fall back to what the index knows
+            manifests = set(self.images.values_list('sub', 'digest'))
+
+        if not manifests:
+            return {'deleted': 0, 'failed': 0}
+
+        async def purge_async() -> dict:
+            subs = {sub for sub, _ in manifests}
+            tokens = await sync_to_async(RepoToken.get_many)(self, [f'{self.repo}/{sub}' for sub in subs])
+            headers = {sub: {'Authorization': f"Bearer {tokens[f'{self.repo}/{sub}'].token}"} for sub in subs}
+            semaphore = asyncio.Semaphore(STAT_CONCURRENCY)
+            progress = {'deleted': 0, 'failed': 0}
+
+            async with httpx.AsyncClient(headers=DOCKER_HEADERS, verify=False,
+                                         limits=httpx.Limits(max_connections=STAT_CONCURRENCY)) as client:
+
+                async def fetch(sub: str, reference: str) -> set[tuple]:
+                    async with semaphore:
+                        manifest = await get_manifest_cached(client, f'{self.repo}/{sub}', reference, headers[sub])
+                    return {(sub, digest) for digest in get_blob_digests(manifest) if digest}
+
+                async def delete(sub: str, kind: str, digest: str, total: int) -> None:
+                    url = f"https://{env.registry_domain}/v2/{self.repo}/{sub}/{kind}/{digest}"
+                    async with semaphore:
+                        ok = await delete_with_retry(client, url, headers[sub])
+
+                    progress['deleted' if ok else 'failed'] += 1
+                    done = progress['deleted'] + progress['failed']
+                    if done % DELETE_PROGRESS_EVERY == 0 or done == total:
+                        logging.info(f"Purging registry {self.repo}: {done}/{total} objects, "
+                                     f"{progress['failed']} failed")
+
+                blob_sets = await asyncio.gather(*[fetch(sub, reference) for sub, reference in manifests])
+                blobs = set().union(*blob_sets)
+                total = len(manifests) + len(blobs)
+
+                # Manifests first, so that no tag is left pointing at missing blobs if the purge stops halfway
+                await asyncio.gather(*[delete(sub, 'manifests', ref, total) for sub, ref in manifests])
+                await asyncio.gather(*[delete(sub, 'blobs', digest, total) for sub, digest in blobs])
+
+            return progress
+
+        result = async_to_sync(purge_async)()
+        self.images.all().delete()
+        return result
+
     def __str__(self):
         return self.name
 
@@ -135,6 +291,20 @@ class ContainerRegistry(models.Model):
         ordering = ['-created_at']
 
 
+def registry_version_key(repo: str) -> str:
+    return f'registry_version_{repo}'
+
+
+@receiver([post_save, post_delete], sender=ContainerRegistry)
+def invalidate_registry_tokens(sender, instance, **kwargs):
+    # Registry tokens cached for the repo were issued for its old visibility
+    key = registry_version_key(instance.repo)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
 class RepoToken(models.Model):
     registry = models.ForeignKey(ContainerRegistry, on_delete=models.CASCADE, related_name='tokens')
     path = models.TextField()
@@ -148,6 +318,30 @@ class RepoToken(models.Model):
             token.renew()
         return token, created
 
+    @classmethod
+    def get_many(cls, registry, paths: list[str]) -> dict[str, 'RepoToken']:
+        """
+        Valid tokens for all the paths of a registry, with one query and one bulk insert for the missing ones
+        """
+        tokens = {token.path: token for token in cls.objects.filter(registry=registry, path__in=paths)}
+        now = timezone.now()
+
+        for token in tokens.values():
+            if token.expires_at <= now:
+                token.renew()
+
+        missing = []
+        for path in paths:
+            if path not in tokens:
+                token = tokens[path] = cls(registry=registry, path=path)
+                token.generate()
+                missing.append(token)
+
+        if missing:
+            cls.objects.bulk_create(missing)
+
+        return tokens
+
     def generate(self):
         self.token = generate_auth_token('repository', self.path, ['pull', 'delete'], days=30)
         self.expires_at = timezone.now() + timezone.timedelta(days=30)
@@ -168,3 +362,25 @@ class RegistryWebhook(models.Model):
     action = models.CharField(max_length=16)
     timestamp = models.DateTimeField(auto_now_add=True)
     content = models.JSONField()
+
+
+class RegistryImage(models.Model):
+    """
+    Index of the tags of a registry, maintained from the registry webhooks and repaired by reindex()
+    """
+    registry = models.ForeignKey(ContainerRegistry, on_delete=models.CASCADE, related_name='images')
+    sub = models.CharField(max_length=255)
+    tag = models.CharField(max_length=128)
+    digest = models.CharField(max_length=100)  # Of the manifest
+    config_digest = models.CharField(max_length=100, blank=True, default='')
+    size = models.BigIntegerField(default=0)
+    pushed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.registry.repo}/{self.sub}:{self.tag}'
+
+    class Meta:
+        db_table = 'container_registry_image'
+        ordering = ['sub', 'tag']
+        unique_together = ('registry', 'sub', 'tag')
@@ -1,17 +1,17 @@
 import logging
 
 from celery import shared_task
+from django.utils.dateparse import parse_datetime
+
 from .models import ContainerRegistry
 
 
 @shared_task(name='delete_registry')
 def delete_registry(crid) -> None:
     cr = ContainerRegistry.objects.get(crid=crid)
-    stats = cr.stat()
     try:
-        for sub in stats:
-            for tag in sub['tags']:
-                cr.delete_image(sub['sub'], tag['name'])
+        result = cr.purge()
+        logging.info(f"Purged registry {cr.repo}: {result['deleted']} objects deleted, {result['failed']} failed")
 
         owner = cr.namespace.owner
 
@@ -21,3 +21,26 @@ def delete_registry(crid) -> None:
 
     except Exception as e:
         logging.exception(e)
+
+
+@shared_task(name='index_registry_image', autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def index_registry_image(crid, sub, tag, digest, pushed_at=None) -> None:
+    cr = ContainerRegistry.objects.get(crid=crid)
+    cr.index_image(sub, tag, digest, parse_datetime(pushed_at) if pushed_at else None)
+
+
+@shared_task(name='reconcile_registry_index')
+def reconcile_registry_index(crid=None) -> None:
+    """
+    Re-crawl registries to repair index drift from missed or failed webhooks
+    """
+    registries = ContainerRegistry.objects.filter(state='active')
+    if crid:
+        registries = registries.filter(crid=crid)
+
+    for cr in registries:
+        try:
+            if not cr.reindex():
+                logging.error(f"Failed to crawl registry {cr.repo}")
+        except Exception as e:
+            logging.exception(e)
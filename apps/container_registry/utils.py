@@ -1,15 +1,32 @@
+import asyncio
 import logging
+import time
 
+from bisect import bisect_left
+from itertools import islice
+from urllib.parse import urljoin
 from regex import match
-from httpx import AsyncClient
+from httpx import AsyncClient, TransportError
 from datetime import datetime, timedelta, timezone
 from os import urandom
 from jwt import encode
 
+from django.core.cache import cache
+
 from core.settings import env
 from ..infra.constants import DOCKER_HEADERS
+from .keys import get_signing_key
 
 CATALOG_TOKEN = None
+CATALOG_INDEX = None  # (fetched_at, sorted repositories)
+CATALOG_PAGE_SIZE = 1000
+CATALOG_CACHE_TTL = 60  # Seconds before the catalog is crawled again
+STAT_CONCURRENCY = 16  # Max in-flight registry requests per stat
+MANIFEST_CACHE_TTL = 7 * 24 * 3600  # Manifests are addressed by digest and never change
+TAG_DIGEST_CACHE_TTL = 24 * 3600  # Seconds a tag's digest is kept, webhooks evict it when the tag is pushed or deleted
+TAG_DIGEST_REVALIDATE = 300  # Seconds before a cached tag digest is checked against the registry again
+DELETE_RETRIES = 3
+DELETE_PROGRESS_EVERY = 100  # Deletions between two progress logs of a bulk delete
 
 
 def validate_registry_spec(spec: dict) -> tuple[bool, str | None]:
@@ -60,11 +77,12 @@ def generate_auth_token(r_type: str | None = None, r_name: None | str = None, ac
     if len(kwargs) == 0:
         kwargs = {'hours': 1}
 
+    signing_key = get_signing_key()
     now = datetime.now(timezone.utc)
     header = {
         'typ': 'JWT',
-        'alg': 'RS256',
-        'kid': env.registry_kid
+        'alg': signing_key.algorithm,
+        'kid': signing_key.kid
     }
     claim = {
         'iss': 'OCR',
@@ -89,8 +107,8 @@ def generate_auth_token(r_type: str | None = None, r_name: None | str = None, ac
     token = encode(
         headers=header,
         payload=claim,
-        algorithm='RS256',
-        key=env.registry_signing_key
+        algorithm=signing_key.algorithm,
+        key=signing_key.key
     )
 
     return token
@@ -108,38 +126,64 @@ def get_registry_permissions(ns_role) -> list:
         return []
 
 
+async def iter_catalog(client: AsyncClient):
+    """
+    Yields the catalog page by page, following the Link header of each page to the next one
+    """
+    url = f"https://{env.registry_domain}/v2/_catalog?n={CATALOG_PAGE_SIZE}"
+    while url:
+        resp = await client.get(url)
+        resp.raise_for_status()
+        yield resp.json().get('repositories') or []
+
+        next_url = resp.links.get('next', {}).get('url')
+        url = urljoin(f"https://{env.registry_domain}", next_url) if next_url else None
+
+
 async def get_all_repositories() -> tuple[str]:
     """
-    Get all repositories from the container registry
+    Get all repositories from the container registry, sorted. The catalog is crawled at most once per CATALOG_CACHE_TTL
     """
-    global CATALOG_TOKEN
+    global CATALOG_TOKEN, CATALOG_INDEX
+    if CATALOG_INDEX and time.monotonic() - CATALOG_INDEX[0] < CATALOG_CACHE_TTL:
+        return CATALOG_INDEX[1]
+
     if not CATALOG_TOKEN:
         CATALOG_TOKEN = generate_auth_token('registry', 'catalog', ['*'], days=360)
     headers = {**DOCKER_HEADERS, 'Authorization': f"Bearer {CATALOG_TOKEN}"}
-    url = f"https://{env.registry_domain}/v2/_catalog"
 
     async with AsyncClient(headers=headers, verify=False) as client:
         try:
-            resp = await client.get(url)
-            data = resp.json()
-            repos = tuple(data.get("repositories", []))
-            return repos
+            repos = []
+            async for page in iter_catalog(client):
+                repos.extend(page)
         except Exception as e:
             logging.error(e)
-            return tuple()
+            return CATALOG_INDEX[1] if CATALOG_INDEX else tuple()  # Stale beats empty
+
+    CATALOG_INDEX = (time.monotonic(), tuple(sorted(repos)))
+    return CATALOG_INDEX[1]
 
 
 async def get_sub_repositories(repo_name) -> list[str]:
     all_repos = await get_all_repositories()
     prefix = f"{repo_name}/"
     prefix_len = len(prefix)
-    return [repo[prefix_len:] for repo in all_repos if repo.startswith(prefix)]
 
+    # Repos sharing the prefix are next to each other in the sorted catalog
+    subs = []
+    for repo in islice(all_repos, bisect_left(all_repos, prefix), None):
+        if not repo.startswith(prefix):
+            break
+        subs.append(repo[prefix_len:])
 
-async def get_tags(client: AsyncClient, repo_path: str) -> list[str]:
+    return subs
+
+
+async def get_tags(client: AsyncClient, repo_path: str, headers: dict | None = None) -> list[str]:
     url = f"https://{env.registry_domain}/v2/{repo_path}/tags/list"
     try:
-        response = await client.get(url)
+        response = await client.get(url, headers=headers)
         if response.status_code == 200:
             data = response.json()
             return data.get("tags", [])
@@ -150,10 +194,10 @@ async def get_tags(client: AsyncClient, repo_path: str) -> list[str]:
         return []
 
 
-async def get_manifest(client: AsyncClient, repo_path: str, tag: str) -> dict:
+async def get_manifest(client: AsyncClient, repo_path: str, tag: str, headers: dict | None = None) -> dict:
     url = f"https://{env.registry_domain}/v2/{repo_path}/manifests/{tag}"
     try:
-        resp = await client.get(url)
+        resp = await client.get(url, headers=headers)
         manifest = resp.json()
         manifest['reference'] = resp.headers.get('Docker-Content-Digest', '')
         return manifest
@@ -162,6 +206,80 @@ async def get_manifest(client: AsyncClient, repo_path: str, tag: str) -> dict:
         return {}
 
 
+def manifest_cache_key(digest: str) -> str:
+    return f'registry_manifest_{digest}'
+
+
+def tag_digest_cache_key(repo_path: str, tag: str) -> str:
+    return f'registry_tag_digest_{repo_path}:{tag}'
+
+
+def evict_cached_tag(repo_path: str, tag: str | None = None, digest: str | None = None) -> None:
+    """
+    Forget what a tag points to, and the manifest of a deleted digest
+    """
+    if tag:
+        cache.delete(tag_digest_cache_key(repo_path, tag))
+    if digest:
+        cache.delete(manifest_cache_key(digest))
+
+
+async def head_digest(client: AsyncClient, repo_path: str, tag: str, headers: dict | None = None) -> str | None:
+    url = f"https://{env.registry_domain}/v2/{repo_path}/manifests/{tag}"
+    try:
+        resp = await client.head(url, headers=headers)
+        return resp.headers.get('Docker-Content-Digest') if resp.status_code == 200 else None
+    except Exception as e:
+        logging.error(e)
+        return None
+
+
+async def get_manifest_cached(client: AsyncClient, repo_path: str, tag: str, headers: dict | None = None) -> dict:
+    """
+    Get the manifest of a tag or digest. Tags resolve to their cached digest, which is checked with a HEAD request
+    once it is older than TAG_DIGEST_REVALIDATE. On a miss, the manifest is fetched and its digest cached for the tag
+    """
+    if tag.startswith('sha256:'):  # Digests never change
+        if manifest := await cache.aget(manifest_cache_key(tag)):
+            return manifest
+        return await fetch_manifest(client, repo_path, tag, headers)
+
+    tag_key = tag_digest_cache_key(repo_path, tag)
+    if cached := await cache.aget(tag_key):
+        digest, checked_at = cached
+
+        if time.time() - checked_at >= TAG_DIGEST_REVALIDATE:
+            if (current := await head_digest(client, repo_path, tag, headers)) is None:
+                digest = None  # Unknown to the registry now, or unreachable. The GET below tells which
+            else:
+                digest = current
+                await cache.aset(tag_key, (digest, time.time()), timeout=TAG_DIGEST_CACHE_TTL)
+
+        if digest and (manifest := await cache.aget(manifest_cache_key(digest))):
+            return manifest
+
+    return await fetch_manifest(client, repo_path, tag, headers)
+
+
+async def fetch_manifest(client: AsyncClient, repo_path: str, reference: str, headers: dict | None = None) -> dict:
+    """
+    GET the manifest and cache it under the digest the registry reports for it, and the tag under that digest
+    """
+    manifest = await get_manifest(client, repo_path, reference, headers)
+    if digest := manifest.get('reference'):
+        await cache.aset(manifest_cache_key(digest), manifest, timeout=MANIFEST_CACHE_TTL)
+        if not reference.startswith('sha256:'):
+            await cache.aset(tag_digest_cache_key(repo_path, reference), (digest, time.time()),
+                             timeout=TAG_DIGEST_CACHE_TTL)
+
+    return manifest
+
+
+def manifest_size(manifest: dict) -> int:
+    layers = manifest.get('layers', [])
+    return sum([layer.get('size', 0) for layer in layers]) + manifest.get('config', {}).get('size', 0)
+
+
 def get_blob_digests(manifest: dict) -> list[str]:
     layers = manifest.get('layers', [])
     return [layer.get('digest', '') for layer in layers] + [manifest.get('config', {}).get('digest', '')]
@@ -174,3 +292,24 @@ async def delete_blob(client: AsyncClient, repo_path: str, digest: str) -> bool:
     except Exception as e:
         logging.exception(e)
         return False
+
+
+async def delete_with_retry(client: AsyncClient, url: str, headers: dict | None = None) -> bool:
+    """
+    Delete a manifest or blob, retrying on server errors with exponential backoff. Already deleted counts as deleted
+    """
+    for attempt in range(DELETE_RETRIES):
+        try:
+            resp = await client.delete(url, headers=headers)
+            if resp.status_code in (202, 404):
+                return True
+            if resp.status_code < 500 and resp.status_code != 429:
+                logging.error(f"Failed to delete {url}: {resp.status_code}")
+                return False
+        except TransportError as e:
+            logging.warning(f"Error deleting {url}: {e}")
+
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+    logging.error(f"Failed to delete {url} after {DELETE_RETRIES} attempts")
+    return False
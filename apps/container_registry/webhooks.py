@@ -6,11 +6,38 @@ from django.views.decorators.http import require_http_methods
 from json import loads as json_loads
 
 from .models import RegistryWebhook, ContainerRegistry
+from .tasks import index_registry_image
+from .utils import evict_cached_tag
 
 from core.utils import success_message, error_message
 from core.settings import env
 
 
+def update_index(webhook: RegistryWebhook) -> None:
+    """
+    Apply a push or delete event to the registry index and the manifest cache. Blob events carry no tag and leave the
+    index as is
+    """
+    target = webhook.content['target']
+    tag = target.get('tag')
+    digest = target.get('digest')
+
+    if webhook.action in ('push', 'delete') and target.get('repository'):
+        # A pushed tag may point elsewhere now, a deleted digest's manifest is gone
+        evict_cached_tag(target['repository'], tag, digest if webhook.action == 'delete' else None)
+
+    if webhook.action == 'push' and tag and digest:
+        pushed_at = webhook.content.get('timestamp')
+        index_registry_image.delay(webhook.registry.crid, webhook.target, tag, digest, pushed_at)
+
+    elif webhook.action == 'delete':
+        images = webhook.registry.images.filter(sub=webhook.target)
+        if tag:
+            images.filter(tag=tag).delete()
+        elif digest:
+            images.filter(digest=digest).delete()
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def registry_webhook(request):
@@ -28,6 +55,8 @@ def registry_webhook(request):
             webhook.target = target
             webhook.save()
 
+            update_index(webhook)
+
         return JsonResponse(success_message('Webhook processed'), status=200)
     except Exception as e:
         logging.exception(e)
@@ -1,5 +1,7 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.core.cache import cache
 
 from core.model_fields import UUID7StringField
 from django.contrib import admin
@@ -9,6 +11,17 @@ from .constants import VOLUME_TYPES
 from .constants import NS_ROLES, R_STATES
 
 
+class NamespaceQuerySet(models.QuerySet):
+    def with_members(self):
+        """
+        Prefetch the roles and users of all members, so that info() and brief() need no further queries
+        """
+        return self.prefetch_related(
+            'users',
+            models.Prefetch('namespaceroles_set', queryset=NamespaceRoles.objects.select_related('user')),
+        )
+
+
 class Namespace(models.Model):
     nsid = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
@@ -19,10 +32,22 @@ class Namespace(models.Model):
     locked = models.BooleanField(default=False)
     state = models.CharField(max_length=16, choices=R_STATES, default='creating')
 
+    objects = NamespaceQuerySet.as_manager()
+
     @property
     def owner(self):
+        if (roles := self.prefetched_roles()) is not None:
+            return next((r.user for r in roles if r.role == 'owner'), None)
         return self.users.get(namespaceroles__role='owner')
 
+    def prefetched_roles(self) -> list | None:
+        """
+        Returns the roles of all members when loaded with Namespace.objects.with_members(), None otherwise
+        """
+        if 'namespaceroles_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return list(self.namespaceroles_set.all())
+        return None
+
     def get_users(self):
         return self.users.all()
 
@@ -30,17 +55,16 @@ class Namespace(models.Model):
         """
         Returns -> 'owner', 'manager', 'viewer' or None
         """
-        try:
-            return self.namespaceroles_set.get(user=user).role
-        except:
-            return None
+        return get_ns_roles(user).get(self.nsid)
 
     def get_users_info(self):
-        u_info = lambda u: {
-            **u.brief(),
-            'role': self.get_role(u),
-        }
-        return [u_info(u) for u in self.users.filter(~Q(namespaceroles__role='owner'))]
+        roles = self.prefetched_roles()
+        if roles is None:
+            roles = self.namespaceroles_set.all()
+
+        # Members are listed through self.users, the same rows and order as before the roles were looked up in bulk
+        role_of = {r.user_id: r.role for r in roles}
+        return [{**u.brief(), 'role': role_of.get(u.pk)} for u in self.users.all() if role_of.get(u.pk) != 'owner']
 
     def info(self, user=None):
         return {
@@ -80,6 +104,43 @@ class NamespaceRoles(models.Model):
         db_table = 'namespace_roles'
 
 
+
+
+def ns_roles_version_key(user_id) -> str:
+    return f'ns_roles_version_{user_id}'
+
+
+def get_ns_roles(user) -> dict[str, str]:
+    """
+    Returns {nsid: role} for all namespaces of the user.
+    The map is loaded with one query and kept on the user object, like Django's permission cache, so it lives as long
+    as the request or websocket connection. The map is checked against the invalidation version on every access, so
+    role changes apply at once to every holder of the user.
+    """
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return {}
+
+    version = cache.get(ns_roles_version_key(user.pk), 0)
+    cached = getattr(user, '_ns_role_cache', None)
+
+    if cached is not None and cached['version'] == version:
+        return cached['roles']
+
+    roles = dict(NamespaceRoles.objects.filter(user=user).values_list('namespace__nsid', 'role'))
+    user._ns_role_cache = {'roles': roles, 'version': version}
+
+    return roles
+
+
+@receiver([post_save, post_delete], sender=NamespaceRoles)
+def invalidate_ns_roles(sender, instance, **kwargs):
+    key = ns_roles_version_key(instance.user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
 class Volume(models.Model):
     volid = UUID7StringField(auto_created=True)
     name = models.CharField(max_length=100)
@@ -45,7 +45,7 @@ def namespace(request, nsid=None):
                 return JsonResponse(success_message('Get namespace', {'namespace': result}), status=200)
 
             if nsid:
-                ns = Namespace.objects.get(nsid=nsid, locked=False)
+                ns = Namespace.objects.with_members().get(nsid=nsid, locked=False)
                 role = ns.get_role(request.user)
                 if role is None:
                     return JsonResponse(error_message('Namespace not found or no permission to access'), status=404)
@@ -53,7 +53,7 @@ def namespace(request, nsid=None):
                 result = ns.brief() if brief_only else ns.info()
                 result['_role'] = role
             else:
-                namespaces = Namespace.objects.filter(users=request.user, locked=False)
+                namespaces = Namespace.objects.filter(users=request.user, locked=False).with_members()
                 result = [ns.brief(request.user) if brief_only else ns.info(request.user) for ns in namespaces]
 
             return JsonResponse(success_message('Get namespaces', {
@@ -0,0 +1,224 @@
+import asyncio
+import atexit
+import logging
+import time
+
+from contextlib import asynccontextmanager
+from copy import deepcopy
+
+from kubernetes_asyncio import config as k8s_aio_config
+from kubernetes_asyncio.client import VersionApi
+from kubernetes_asyncio.client.api_client import ApiClient as k8s_aio_ApiClient, Configuration as k8s_aio_Configuration
+from kubernetes_asyncio.stream import WsApiClient as k8s_aio_WsApiClient
+
+from .settings import env
+
+REST_POOL_MAXSIZE = 64  # Max concurrent connections to the API server per event loop
+WS_POOL_MAXSIZE = 32  # Max concurrent exec/attach websockets per event loop
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_TIMEOUT = 5
+
+
+class K8sClientPool:
+    """
+    Long-lived async Kubernetes API clients shared by everything running on an event loop.
+    Each loop gets one REST client and one websocket client, each with its own bounded, keep-alive connection pool.
+    Callers borrow clients with get() and give them back with release(), they must not close them.
+    A client that fails its health check is replaced right away, but only closed once its last borrower releases it.
+    """
+
+    def __init__(self):
+        self.configuration = None
+        # event loop -> {'lock': Lock, 'rest': client, 'ws': client, 'checked_at': float,
+        #                'borrowers': {client: count}, 'retired': set of replaced clients still borrowed}
+        self.loops = {}
+
+    async def load_configuration(self) -> k8s_aio_Configuration:
+        """
+        Parse the kubeconfig once per process
+        """
+        if self.configuration is None:
+            k8s_config = k8s_aio_Configuration()
+            await k8s_aio_config.load_kube_config_from_dict(
+                config_dict=env.k8s_config_dict,
+                client_configuration=k8s_config
+            )
+            self.configuration = k8s_config
+
+        return self.configuration
+
+    def new_client(self, ws=False) -> k8s_aio_ApiClient | k8s_aio_WsApiClient:
+        k8s_config = deepcopy(self.configuration)  # The parsed kubeconfig is shared, each client sizes its own pool
+        k8s_config.connection_pool_maxsize = WS_POOL_MAXSIZE if ws else REST_POOL_MAXSIZE
+
+        if ws:
+            return k8s_aio_WsApiClient(configuration=k8s_config)
+        return k8s_aio_ApiClient(configuration=k8s_config)
+
+    def loop_state(self) -> dict:
+        loop = asyncio.get_running_loop()
+
+        for stale_loop in [lp for lp in self.loops if lp.is_closed()]:  # Forget loops that went away
+            self.discard_clients(self.loops.pop(stale_loop))
+
+        if loop not in self.loops:
+            self.loops[loop] = {
+                'lock': asyncio.Lock(),
+                'rest': None,
+                'ws': None,
+                'checked_at': 0,
+                'borrowers': {},
+                'retired': set(),
+            }
+
+        return self.loops[loop]
+
+    @staticmethod
+    def clients_of(state: dict) -> list:
+        return [c for c in (state['rest'], state['ws'], *state['retired']) if c is not None]
+
+    def discard_clients(self, state: dict) -> None:
+        """
+        Drop the clients of a loop that closed without close(). Their sessions cannot be awaited anymore, so their
+        connectors are closed synchronously, which releases the sockets
+        """
+        for client in self.clients_of(state):
+            session = getattr(client.rest_client, 'pool_manager', None)
+            if session is None or session.closed:
+                continue
+
+            logging.warning("Closing a k8s client left open by a closed event loop")
+            try:
+                session.connector._close()
+            except Exception as e:
+                logging.error(f"Error closing k8s client of a closed loop: {e}")
+
+    @staticmethod
+    def is_closed(client) -> bool:
+        session = getattr(client.rest_client, 'pool_manager', None)
+        return session is None or session.closed
+
+    async def is_healthy(self, client: k8s_aio_ApiClient) -> bool:
+        try:
+            await asyncio.wait_for(VersionApi(client).get_code(), timeout=HEALTH_CHECK_TIMEOUT)
+            return True
+        except Exception as e:
+            logging.warning(f"k8s client health check failed: {e}")
+            return False
+
+    async def get(self, ws=False) -> k8s_aio_ApiClient | k8s_aio_WsApiClient:
+        """
+        :param ws: Whether to return the websocket client
+        Returns the pooled Kubernetes async API client of the running event loop. Do not close it, release() it.
+        """
+        state = self.loop_state()
+        kind = 'ws' if ws else 'rest'
+
+        async with state['lock']:
+            await self.load_configuration()
+
+            client = state[kind]
+
+            if client is not None and self.is_closed(client):
+                client = None
+
+            # The websocket client can only open websockets, so the REST client's probe stands in for both
+            probe = client is not None and not ws and time.monotonic() - state['checked_at'] > HEALTH_CHECK_INTERVAL
+
+            if client is None:
+                client = state[kind] = self.new_client(ws=ws)
+
+            if not ws:
+                state['checked_at'] = time.monotonic()  # Also keeps other borrowers from probing at the same time
+
+            if not probe:
+                return self.lend(state, client)
+
+        # Probed outside the lock, so a slow API server does not hold up the other borrowers meanwhile
+        healthy = await self.is_healthy(client)
+
+        async with state['lock']:
+            if not healthy and state[kind] is client:
+                await self.retire(state, client)
+                state[kind] = self.new_client(ws=ws)
+
+            return self.lend(state, state[kind])
+
+    @staticmethod
+    def lend(state: dict, client):
+        state['borrowers'][client] = state['borrowers'].get(client, 0) + 1
+        return client
+
+    async def release(self, client) -> None:
+        """
+        Give back a client borrowed with get(), closing it if it was replaced while borrowed
+        """
+        state = self.loops.get(asyncio.get_running_loop())
+        if state is None or client is None:
+            return None
+
+        count = state['borrowers'].get(client, 0) - 1
+        if count > 0:
+            state['borrowers'][client] = count
+            return None
+
+        state['borrowers'].pop(client, None)
+        if client in state['retired']:
+            state['retired'].discard(client)
+            await self.close_client(client)
+
+    @asynccontextmanager
+    async def borrow(self, ws=False):
+        """
+        Borrow a client for the duration of the block
+        """
+        client = await self.get(ws=ws)
+        try:
+            yield client
+        finally:
+            await self.release(client)
+
+    async def retire(self, state: dict, client) -> None:
+        if state['borrowers'].get(client):
+            state['retired'].add(client)  # Closed by the last release()
+        else:
+            await self.close_client(client)
+
+    @staticmethod
+    async def close_client(client) -> None:
+        try:
+            await client.close()
+        except Exception as e:
+            logging.error(f"Error closing k8s client: {e}")
+
+    async def close(self) -> None:
+        """
+        Close the clients of the running event loop
+        """
+        state = self.loops.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return None
+
+        for client in self.clients_of(state):
+            await self.close_client(client)
+
+    def shutdown(self) -> None:
+        """
+        Close the clients of every loop that is still around, for use at interpreter exit
+        """
+        for loop, state in list(self.loops.items()):
+            clients = self.clients_of(state)
+            if loop.is_closed() or loop.is_running() or not clients:
+                continue
+
+            try:
+                loop.run_until_complete(asyncio.gather(*[self.close_client(c) for c in clients]))
+            except Exception as e:
+                logging.error(f"Error shutting down k8s client pool: {e}")
+
+        self.loops = {}
+
+
+k8s_client_pool = K8sClientPool()
+
+atexit.register(k8s_client_pool.shutdown)
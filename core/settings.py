@@ -12,7 +12,7 @@ from dataclasses import dataclass
 from urllib.parse import urlparse
 from yaml import safe_load
 
-from .utils import load_file_from_s3, load_file, generate_kid, cleanup
+from .utils import load_file_from_s3, load_file, cleanup
 
 load_dotenv(override=True if os.environ.get('DEBUG') is None else False)
 
@@ -61,6 +61,10 @@ class Env:
 
     rabbitmq_url = os.getenv('MQ_URL')
 
+    shared_backend = os.getenv('SHARED_BACKEND', 'local')  # 'local', 'redis' or 'fakeredis'
+    redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    redis_key_prefix = os.getenv('REDIS_KEY_PREFIX', 'osiris')
+
     cf_storage_url = os.getenv('CF_STORAGE_URL')
     cf_access_key = os.getenv('CF_ACCESS_KEY')
     cf_secret_key = os.getenv('CF_SECRET_KEY')
@@ -83,7 +87,6 @@ class Env:
     registry_domain = os.getenv('REGISTRY_DOMAIN')
     registry_key_obj_path = os.getenv('REGISTRY_KEY_OBJECT_PATH')
     registry_signing_key = ''
-    registry_kid = ''
     registry_webhook_secret = os.getenv('REGISTRY_WEBHOOK_SECRET')
 
     container_apps_domain = os.getenv('CONTAINER_APPS_DOMAIN')
@@ -135,10 +138,6 @@ class Env:
             self.registry_signing_key = load_file_from_s3(self.registry_key_obj_path, self.aws_access_key,
                                                           self.aws_secret_key)
 
-        if self.registry_signing_key:
-            self.registry_kid = generate_kid(self.registry_signing_key, 'RSA')
-            print('# Generated keyid from registry signing key')
-
 
 env = Env()
 
@@ -209,11 +208,28 @@ MIDDLEWARE = [
 
 APPEND_SLASH = False
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# Channel layer and cache shared by all workers.
+# 'local' keeps both in process memory, 'redis' shares them through Redis so that Daphne workers can scale out,
+# and 'fakeredis' runs the Redis cache against an in-process fake server, for tests and local development.
+# fakeredis is a development dependency, installed from requirements-dev.txt.
+if env.shared_backend == 'redis':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [env.redis_url],
+                "prefix": f"{env.redis_key_prefix}:asgi",
+                "capacity": 1000,
+                "expiry": 60,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 WSGI_APPLICATION = "core.wsgi.application"
 ASGI_APPLICATION = "core.asgi.application"
@@ -312,6 +328,13 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'EST'
 CELERY_TASK_ALWAYS_EAGER = DEBUG  # Setting this to True will run tasks synchronously and block the main thread
 
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-registry-index': {
+        'task': 'reconcile_registry_index',
+        'schedule': 6 * 60 * 60,  # Repairs registry index drift every 6 hours
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -327,12 +350,35 @@ REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'apps.api.exceptions.exception_processor',
 }
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'osiris-app-cache',
+if env.shared_backend in ('redis', 'fakeredis'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': env.redis_url,
+            'KEY_PREFIX': env.redis_key_prefix,
+            'OPTIONS': {
+                'pool_class': 'redis.BlockingConnectionPool',
+                'parser_class': 'redis.connection._HiredisParser',
+                'max_connections': 50,
+                'timeout': 5,  # Seconds to wait for a free connection from the pool
+                'socket_connect_timeout': 2,
+                'socket_timeout': 2,
+                'health_check_interval': 30,
+            },
+        }
+    }
+
+    if env.shared_backend == 'fakeredis':
+        from fakeredis import FakeConnection
+
+        CACHES['default']['OPTIONS']['connection_class'] = FakeConnection
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'osiris-app-cache',
+        }
     }
-}
 
 OIDC_LOGIN_URL = '/login/nyu'
 OIDC_IDTOKEN_INCLUDE_CLAIMS = True
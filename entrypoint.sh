@@ -11,6 +11,12 @@ doppler run -- python manage.py collectstatic --no-input
 echo "Starting Celery worker in background"
 doppler run -- python3 -m celery -A core worker --loglevel INFO &
 
+# Only one beat may run across all replicas, or scheduled tasks run once per replica
+if [ "$CELERY_BEAT" = "true" ]; then
+  echo "Starting Celery beat in background"
+  doppler run -- python3 -m celery -A core beat --loglevel INFO &
+fi
+
 sleep 2
 
 exec doppler run -- "$@"
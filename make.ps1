@@ -17,6 +17,7 @@ function Show-Help
     Write-Host "### .\make.ps1 django - Start Django server"
     Write-Host "### .\make.ps1 web - Start Webpack"
     Write-Host "### .\make.ps1 celery - Start Celery worker"
+    Write-Host "### .\make.ps1 celery-beat - Start Celery beat"
     Write-Host "### .\make.ps1 build - Build static files"
     Write-Host "### .\make.ps1 migrations - Make and apply migrations"
     Write-Host "### .\make.ps1 index - Reindex Algolia"
@@ -31,7 +32,7 @@ function Create-Venv
         Write-Host "### Creating virtual environment"
         & $PYTHON -m venv venv
         & $PY_VENV -m pip install --upgrade pip
-        & $PIP install -r requirements.txt
+        & $PIP install -r requirements-dev.txt
     }
 }
 
@@ -81,6 +82,19 @@ function Start-Celery
     }
 }
 
+function Start-Celery-Beat
+{
+    if (Test-Path .env)
+    {
+        Write-Host "### Starting Celery beat"
+        & $PY_VENV -m celery -A core beat --loglevel INFO
+    }
+    else
+    {
+        Write-Host "[Celery] env file missing"
+    }
+}
+
 function Start-Migrations
 {
     Write-Host "### Making migrations"
@@ -217,6 +231,10 @@ switch ($Target)
         Load-Env
         Start-Celery
     }
+    "celery-beat" {
+        Load-Env
+        Start-Celery-Beat
+    }
     "build" {
         Start-Build
     }
@@ -1,6 +1,13 @@
 window.addEventListener('load', function () {
     const SESSION_TIMEOUT = 60000;
 
+    // Binary shell protocol: every frame is a channel byte followed by the raw payload
+    const SHELL_PROTOCOL = 'osiris.shell.v2';
+    const STDIN_CHANNEL = 0;
+    const STDOUT_CHANNEL = 1;
+    const STDERR_CHANNEL = 2;
+    const textEncoder = new TextEncoder();
+
     let isInitializingTerminal = false; // Flag to prevent concurrent connections
     let activeTabId = null;
 
@@ -246,7 +253,8 @@ window.addEventListener('load', function () {
 
         tabInfo.pendingConnection = setTimeout(() => {
             try {
-                const socket = new WebSocket(`/api/container-apps/${currentURL.nsid}/${currentURL.resource_id}/shell/${iref}/${cref}`);
+                const socket = new WebSocket(`/api/container-apps/${currentURL.nsid}/${currentURL.resource_id}/shell/${iref}/${cref}`, [SHELL_PROTOCOL]);
+                socket.binaryType = 'arraybuffer';
 
                 socket.onopen = () => {
                     tabInfo.pendingConnection = null;
@@ -260,10 +268,24 @@ window.addEventListener('load', function () {
                     tabInfo.socket = socket;
                     tabInfo.hadSocketBefore = true;
 
-                    tabInfo.terminal.onData(data => {
+                    const binary = socket.protocol === SHELL_PROTOCOL;
+
+                    if (tabInfo.dataListener) {
+                        tabInfo.dataListener.dispose();
+                    }
+
+                    tabInfo.dataListener = tabInfo.terminal.onData(data => {
                         if (socket && socket.readyState === WebSocket.OPEN) {
-                            const encodedData = btoa(data); // Encode the command with Base64 before sending
-                            socket.send(encodedData);
+                            if (binary) {
+                                const payload = textEncoder.encode(data);
+                                const frame = new Uint8Array(payload.length + 1);
+                                frame[0] = STDIN_CHANNEL;
+                                frame.set(payload, 1);
+                                socket.send(frame);
+                            } else {
+                                const encodedData = btoa(data); // Encode the command with Base64 before sending
+                                socket.send(encodedData);
+                            }
                         }
                     });
 
@@ -271,22 +293,37 @@ window.addEventListener('load', function () {
                     sendTerminalDimensions(tabInfo);
                 };
 
+                function onFirstOutput() {
+                    if (!tabInfo.initialDataReceived && !tabInfo.initialResizeSent) {
+                        tabInfo.initialDataReceived = true;
+                        tabInfo.initialResizeSent = true;
+
+                        setTimeout(() => {
+                            sendTerminalDimensions(tabInfo);
+                        }, 100);
+                    }
+                }
+
                 socket.onmessage = (event) => {
+                    if (event.data instanceof ArrayBuffer) {
+                        const frame = new Uint8Array(event.data);
+                        if (frame.length < 2) return;
+
+                        // xterm decodes UTF-8 itself and handles characters split across writes
+                        if (frame[0] === STDOUT_CHANNEL || frame[0] === STDERR_CHANNEL) {
+                            tabInfo.terminal.write(frame.subarray(1));
+                            if (frame[0] === STDOUT_CHANNEL) onFirstOutput();
+                        }
+                        return;
+                    }
+
                     const text = event.data;
                     try {
                         if (text.startsWith('stdout:')) {
                             const encodedData = text.substring(7); // Remove 'stdout:' prefix
                             const decodedData = atob(encodedData);
                             tabInfo.terminal.write(decodedData);
-
-                            if (!tabInfo.initialDataReceived && !tabInfo.initialResizeSent) {
-                                tabInfo.initialDataReceived = true;
-                                tabInfo.initialResizeSent = true;
-
-                                setTimeout(() => {
-                                    sendTerminalDimensions(tabInfo);
-                                }, 100);
-                            }
+                            onFirstOutput();
                             return;
                         }
 
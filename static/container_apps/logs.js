@@ -543,17 +543,18 @@ window.addEventListener('load', function () {
                 socket.onmessage = (event) => {
                     try {
                         const data = JSON.parse(event.data);
-                        if (data.log !== undefined) {
-                            const logLine = data.log;
+                        if (data.logs !== undefined) {
+                            if (data.dropped) {
+                                tabInfo.terminal.writeln(`\x1b[33m... ${data.dropped} lines skipped to keep up ...\x1b[0m`);
+                            }
 
                             // Always store the full log content with timestamps
-                            tabInfo.logContent += logLine + '\n';
+                            tabInfo.logContent += data.logs.map(line => line + '\n').join('');
 
-                            // Display according to timestamp preference
-                            if (tabInfo.showTimestamps) {
-                                tabInfo.terminal.writeln(logLine);
-                            } else {
-                                tabInfo.terminal.writeln(stripTimestamp(logLine));
+                            // Display according to timestamp preference, one write per batch
+                            const lines = tabInfo.showTimestamps ? data.logs : data.logs.map(stripTimestamp);
+                            if (lines.length) {
+                                tabInfo.terminal.write(lines.join('\r\n') + '\r\n');
                             }
 
                             if (tabInfo.autoScrollEnabled) {
@@ -10,6 +10,7 @@ window.addEventListener('load', function () {
 
     let selectedInstance = null;
     let instancesCache = {};
+    let eventsCache = {};
 
     let CPU_LIMIT = 0; // Cores
     let MEMORY_LIMIT = 0; // MB
@@ -68,9 +69,15 @@ window.addEventListener('load', function () {
             }
 
             if (data.events !== undefined) {
+                eventsCache = {};
+                data.events.forEach(e => eventsCache[e.id] = e);
                 updateEvents(data.events);
             }
 
+            if (data.event !== undefined) {
+                handleEventUpdate(data.event);
+            }
+
             if (data.usage !== undefined) {
                 const cpu = {
                     'limit': CPU_LIMIT,
@@ -101,6 +108,17 @@ window.addEventListener('load', function () {
         return socket;
     }
 
+    function handleEventUpdate(update) {
+        if (update.event === 'delete') {
+            delete eventsCache[update.data.id];
+        } else {
+            eventsCache[update.data.id] = update.data;
+        }
+
+        const events = Object.values(eventsCache).sort((a, b) => (b.time || '').localeCompare(a.time || ''));
+        updateEvents(events);
+    }
+
     function renumberInstances() {
         const irefs = [];
 